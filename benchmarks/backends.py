@@ -0,0 +1,103 @@
+# Страница целиком (AppTest) в режимах DATA_BACKEND = "snapshot" и "server" на одной синтетической таблице.
+# Запросы PostgREST обслуживает заглушка, функции режима server - локальный Postgres (pgserver).
+# Шаги: холодный старт / весь период / 30 дней / 30 дней и 2 источника / повторный запуск.
+# Каждый режим - в отдельном процессе (кэши Streamlit и DATA_BACKEND задаются при загрузке скрипта);
+# значения KPI карточек на каждом шаге сверяются между режимами, кроме тех, что режимы считают по-разному.
+#   python benchmarks/backends.py 10000 100000 [--latency 0.02]
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import stand_in
+
+# Без сверки: уникальные клиенты в снимке - оценка HLL, на сервере - точный подсчет;
+# доля позитивных в снимке считается по тональности текста, на сервере - по оценкам
+UNMATCHED_METRICS = {"Уникальных клиентов", "Позитивные"}
+CACHE_FILES = {
+    "SNAPSHOT_PATH": "reviews.arrow",
+    "SENTIMENT_PATH": "sentiment.arrow",
+    "DUPLICATES_PATH": "duplicates.arrow",
+    "ANOMALIES_PATH": "anomalies.json",
+}
+STEPS = ["холодный старт", "весь период", "30 дней", "30 дней, 2 источника", "повтор"]
+
+
+def measure(backend, rows, latency):
+    import supabase
+    from streamlit.testing.v1 import AppTest
+
+    # Модули приложения (text_analysis и др.) импортируются скриптом из корня репозитория
+    sys.path.insert(0, stand_in.ROOT)
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore")
+    df = stand_in.make_reviews(rows, days=1000)
+    database = stand_in.local_postgres(df) if backend == "server" else None
+    client = stand_in.StandInClient(df, latency=latency, database=database)
+    # Скрипт импортирует create_client при каждом запуске - подменяется в модуле supabase
+    supabase.create_client = lambda url, key: client
+    at = AppTest.from_file(stand_in.APP_PATH, default_timeout=3600)
+    at.secrets["SUPABASE_URL"] = "http://stand-in"
+    at.secrets["SUPABASE_KEY"] = "stand-in"
+    at.secrets["DATA_BACKEND"] = backend
+    # Файлы кэшей приложения - во временном каталоге: снимок прошлого запуска (другая таблица)
+    # подхватился бы при холодном старте вместо загрузки
+    cache_dir = tempfile.mkdtemp(prefix="benchmark-")
+    for name, file_name in CACHE_FILES.items():
+        at.secrets[name] = os.path.join(cache_dir, file_name)
+    actions = [
+        at.run,
+        lambda: at.selectbox[0].set_value("Весь период").run(),
+        lambda: at.selectbox[0].set_value("Последние 30 дней").run(),
+        lambda: at.multiselect[0].set_value(["banki.ru", "google"]).run(),
+        at.run,
+    ]
+    seconds, metrics = [], []
+    for label, action in zip(STEPS, actions):
+        started = time.perf_counter()
+        action()
+        seconds.append(time.perf_counter() - started)
+        assert not at.exception, f"{backend}, {label}: {[error.message for error in at.exception]}"
+        metrics.append({metric.label: metric.value for metric in at.metric})
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return {"seconds": seconds, "metrics": metrics, "requests": client.requests}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int, nargs="*", default=[10_000, 100_000])
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка одного запроса, с")
+    parser.add_argument("--measure", choices=["snapshot", "server"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.rows[0], args.latency)))
+        return
+    print("Время шагов, с: " + " / ".join(STEPS))
+    for rows in args.rows:
+        results = {}
+        for backend in ("snapshot", "server"):
+            command = [sys.executable, __file__, str(rows), "--latency", str(args.latency), "--measure", backend]
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            results[backend] = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{rows:>9,} строк  {backend:8s}: "
+                + " / ".join(f"{value:.2f}" for value in results[backend]["seconds"])
+                + f"  ({results[backend]['requests']} запросов)"
+            )
+        for label, snapshot, server in zip(STEPS, results["snapshot"]["metrics"], results["server"]["metrics"]):
+            for name in set(snapshot) | set(server):
+                if name not in UNMATCHED_METRICS:
+                    assert snapshot.get(name) == server.get(name), (
+                        f"{label}, {name}: снимок {snapshot.get(name)}, сервер {server.get(name)}"
+                    )
+        print(f"{rows:>9,} строк: KPI карточек совпадают на всех шагах")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# Дневной куб (ReviewCube) против расчета по строкам снимка.
+# 1. Время KPI и агрегатов графиков: по отфильтрованным строкам и по ячейкам куба.
+# 2. Сверка: snapshot_view на случайных периодах/источниках/оценках дает те же KPI, ряд по дням,
+#    доли источников и топ городов, что и фильтрация строк (уникальные авторы - оценка HLL,
+#    для них печатается максимальная относительная ошибка).
+# 3. Сверка: куб после дозагрузки, изменения и удаления строк совпадает с кубом, собранным заново.
+#   python benchmarks/cube.py 1000000 5000000 [--selections 300] [--check-rows 200000]
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import stand_in
+
+ALL_RATINGS = (1, 5)
+
+
+def rows_path(df, app, period_start):
+    idx = app['filter_reviews'](df, period_start, None, stand_in.SOURCES, ALL_RATINGS)
+    ratings = app['take'](df, idx, 'rating')
+    kpis = app['compute_kpis'](ratings, responses=app['take'](df, idx, 'has_response'))
+    pd.Series(ratings).groupby(app['take'](df, idx, 'review_day')).agg(['count', 'sum'])
+    np.bincount(df['source'].cat.codes.to_numpy()[idx])
+    np.bincount(df['author_location'].cat.codes.to_numpy()[idx] + 1)
+    return kpis['total']
+
+
+def cube_path(df, cube, app, period_start):
+    daily_cells, geo_cells = cube.select(df, period_start, None, stand_in.SOURCES, ALL_RATINGS)
+    kpis = app['compute_kpis'](
+        daily_cells['rating'].to_numpy(), daily_cells['reviews'].to_numpy(), daily_cells['responses'].to_numpy()
+    )
+    app['sum_by_day'](daily_cells, 'reviews')
+    app['sum_by_day'](daily_cells.assign(rating=daily_cells['rating'] * daily_cells['reviews']), 'rating')
+    app['sum_by_category'](df, daily_cells, 'source')
+    app['sum_by_category'](df, geo_cells, 'author_location')
+    return kpis['total']
+
+
+def best_of(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def timings(app, rows):
+    df = stand_in.make_snapshot(rows)
+    started = time.perf_counter()
+    cube = app['ReviewCube'](df)
+    print(
+        f"{rows:>10,} строк: куб собирается за {time.perf_counter() - started:.1f} с, "
+        f"ячеек дней {len(cube.daily):,}, ячеек с городами {len(cube.geo):,}"
+    )
+    for label, period_start in (("30 дней", datetime.now() - timedelta(days=30)), ("Весь период", None)):
+        by_rows = best_of(lambda: rows_path(df, app, period_start))
+        by_cube = best_of(lambda: cube_path(df, cube, app, period_start))
+        assert by_rows[1] == by_cube[1], "число отзывов расходится"
+        print(f"    {label:12s} строки {by_rows[0] * 1000:5.0f} мс -> куб {by_cube[0] * 1000:4.0f} мс")
+
+
+# ============= СВЕРКА С ФИЛЬТРАЦИЕЙ СТРОК =============
+def reference(df, app, period_start, period_end, sources, rating_range):
+    rows = df.iloc[app['filter_reviews'](df, period_start, period_end, sources, rating_range)]
+    kpis = app['compute_kpis'](rows['rating'].to_numpy(), responses=rows['has_response'].to_numpy())
+    kpis['unique_authors'] = rows['author'].nunique()
+    days = rows.groupby('review_day')['rating'].agg(['count', 'sum'])
+    located = app['_with_location'](rows)
+    return {
+        'kpis': kpis,
+        'daily': days,
+        'sources': rows['source'].value_counts().loc[lambda counts: counts > 0],
+        'locations': located['author_location'].value_counts().loc[lambda counts: counts > 0],
+    }
+
+
+def same_kpis(view, expected):
+    for name, value in expected.items():
+        if name == 'unique_authors':
+            continue
+        assert np.allclose(view[name], value), name
+
+
+def random_selection(df, rng):
+    first, last = df['review_date'].iloc[0], df['review_date'].iloc[-1]
+    span = (last - first).total_seconds()
+    # Границы с точностью до секунды: неполные крайние дни идут по строкам
+    moments = sorted(first + pd.Timedelta(seconds=int(value)) for value in rng.uniform(-86400, span + 86400, 2))
+    period_start = None if rng.random() < 0.15 else moments[0].to_pydatetime()
+    period_end = None if rng.random() < 0.5 else moments[1].to_pydatetime()
+    sources = list(rng.choice(stand_in.SOURCES, rng.integers(1, len(stand_in.SOURCES) + 1), replace=False))
+    low = int(rng.integers(1, 6))
+    return period_start, period_end, sources, (low, int(rng.integers(low, 6)))
+
+
+def check_selections(app, rows, selections):
+    rng = np.random.default_rng(1)
+    df = stand_in.make_snapshot(rows, days=120)
+    # Часть строк без города: они не должны попадать в график географии
+    df['author_location'] = df['author_location'].where(rng.random(len(df)) > 0.1)
+    cube = app['ReviewCube'](df)
+    cache = app['FilterCache'](app['FILTER_CACHE_BYTES'])
+    errors = []
+    for _ in range(selections):
+        period_start, period_end, sources, rating_range = random_selection(df, rng)
+        view = app['snapshot_view'](df, cube, period_start, period_end, sources, rating_range, cache)
+        expected = reference(df, app, period_start, period_end, sources, rating_range)
+        same_kpis(view['kpis'], expected['kpis'])
+        if expected['kpis']['unique_authors']:
+            errors.append(abs(view['kpis']['unique_authors'] / expected['kpis']['unique_authors'] - 1))
+        prev_start, prev_end = app['previous_period'](period_start, period_end)
+        if prev_start is not None:
+            same_kpis(view['prev_kpis'], reference(df, app, prev_start, prev_end, sources, rating_range)['kpis'])
+        daily = view['daily']
+        assert daily['Количество'].tolist() == expected['daily']['count'].tolist()
+        assert np.allclose(daily['Средний рейтинг'], expected['daily']['sum'] / expected['daily']['count'])
+        assert view['sources'].to_dict() == expected['sources'].to_dict()
+        # Топ городов: при равных значениях порядок может отличаться, сверяются значения и подписи
+        locations = view['locations']
+        top = expected['locations'].sort_values(ascending=False).head(app['LOCATION_LIMIT'])
+        assert locations.tolist() == top.tolist()
+        assert (expected['locations'][locations.index] == locations).all()
+    print(
+        f"{selections} случайных выборок на {rows:,} строках совпадают с фильтрацией строк; "
+        f"ошибка HLL уникальных авторов до {max(errors, default=0) * 100:.1f}% "
+        f"(стандартная {app['HLL_ERROR'] * 100:.1f}%)"
+    )
+
+
+def check_updates(app, rows):
+    # Дозагрузка новых строк, изменение старых и удаление - через ReviewSync, как при обновлении
+    rng = np.random.default_rng(2)
+    final = stand_in.make_snapshot(rows, days=120)
+    changed = rng.random(len(final)) < 0.05
+    fresh = ~changed & (rng.random(len(final)) < 0.05)
+    initial = final[~fresh].copy()
+    old = changed[~fresh]
+    # Прежние версии измененных строк: другие оценка, источник, ответ и дата
+    initial.loc[old, 'rating'] = (initial.loc[old, 'rating'] % 5 + 1).astype(np.int8)
+    initial.loc[old, 'has_response'] = ~initial.loc[old, 'has_response']
+    codes = initial['source'].cat.codes.to_numpy().copy()
+    codes[old] = (codes[old] + 1) % len(stand_in.SOURCES)
+    initial['source'] = pd.Categorical.from_codes(codes, stand_in.SOURCES)
+    initial.loc[old, 'review_date'] -= pd.Timedelta(days=3)
+    initial['review_day'] = initial['review_date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    sync = app['ReviewSync']()
+    sync.df = app['_sort_by_date'](initial)
+    sync.cube = app['ReviewCube'](sync.df)
+    sync._merge(app['_sort_by_date'](final[changed | fresh]))
+    # Удаление на сервере, как в _reconcile
+    alive = rng.random(len(sync.df)) > 0.03
+    removed = sync.df[~alive]
+    sync.df = sync.df[alive].reset_index(drop=True)
+    sync._update_cube(removed=removed)
+
+    rebuilt = app['ReviewCube'](sync.df)
+    for name in ('daily', 'geo'):
+        incremental = getattr(sync.cube, name).astype(np.int64).reset_index(drop=True)
+        assert incremental.equals(getattr(rebuilt, name).astype(np.int64).reset_index(drop=True)), name
+    assert np.array_equal(sync.cube.authors, rebuilt.authors), "скетчи авторов"
+    print(
+        f"куб после дозагрузки {int(fresh.sum()):,}, изменения {int(changed.sum()):,} и удаления "
+        f"{len(removed):,} строк совпадает с собранным заново (ячейки и скетчи HLL)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int, nargs="*", default=[1_000_000, 5_000_000])
+    parser.add_argument("--selections", type=int, default=300, help="случайных выборок в сверке")
+    parser.add_argument("--check-rows", type=int, default=200_000, help="строк в кадре сверок")
+    args = parser.parse_args()
+    app = stand_in.load_app()
+    check_selections(app, args.check_rows, args.selections)
+    check_updates(app, args.check_rows)
+    print("KPI и агрегаты графиков, все источники и оценки, лучший из 3")
+    for rows in args.rows:
+        timings(app, rows)
+
+
+if __name__ == "__main__":
+    main()
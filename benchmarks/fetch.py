@@ -0,0 +1,87 @@
+# Загрузка таблицы reviews через заглушку PostgREST: один запрос select("*") (как до постраничной
+# загрузки; лимит строк ответа снят, иначе он вернул бы только первые max-rows строк) против fetch_reviews.
+# Каждый замер - в отдельном процессе: пик RSS относится только к нему.
+# С --tracemalloc дополнительно считается пик аллокаций Python (медленнее, время не показательно).
+#   python benchmarks/fetch.py 50000 200000 [--latency 0.02] [--tracemalloc]
+import argparse
+import gc
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import stand_in
+
+
+def rss():
+    # Текущий и пиковый RSS процесса, байты (Linux)
+    values = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                name, size, _ = line.split()
+                values[name[:-1]] = int(size) * 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+def measure(mode, rows, latency, trace):
+    app = stand_in.load_app()
+    client = stand_in.StandInClient(stand_in.make_reviews(rows), latency=latency, max_rows=None)
+    gc.collect()
+    # Сброс пика RSS: в пик не попадают генерация данных и загрузка приложения
+    with open("/proc/self/clear_refs", "w") as refs:
+        refs.write("5")
+    before, _ = rss()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "single":
+        loaded = pd.DataFrame(client.table("reviews").select("*").execute().data)
+    else:
+        loaded = app["fetch_reviews"](client, response_flag=True)
+    elapsed = time.perf_counter() - started
+    _, peak = rss()
+    traced = tracemalloc.get_traced_memory()[1] if trace else None
+    return {
+        "traced_peak": traced,
+        "mode": mode,
+        "rows": len(loaded),
+        "seconds": elapsed,
+        "requests": client.requests,
+        "rss_growth": peak - before,
+        "peak_rss": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int, nargs="*", default=[50_000, 200_000])
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка одного запроса, с")
+    parser.add_argument("--tracemalloc", action="store_true", help="пик аллокаций Python")
+    parser.add_argument("--measure", choices=["single", "paged"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.rows[0], args.latency, args.tracemalloc)))
+        return
+    print(f"Задержка запроса {args.latency * 1000:.0f} мс; пик RSS - прирост за время загрузки")
+    for rows in args.rows:
+        for mode in ("single", "paged"):
+            command = [sys.executable, __file__, str(rows), "--latency", str(args.latency), "--measure", mode]
+            output = subprocess.run(
+                command + (["--tracemalloc"] if args.tracemalloc else []),
+                check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{rows:>9,} строк  {mode:6s}: {result['rows'] / result['seconds']:>9,.0f} строк/с, "
+                f"{result['requests']:>4} запросов, пик RSS +{result['rss_growth'] / 2 ** 20:5.0f} МБ "
+                f"(всего {result['peak_rss'] / 2 ** 20:.0f} МБ)"
+                + (f", пик аллокаций {result['traced_peak'] / 2 ** 20:.0f} МБ" if args.tracemalloc else "")
+            )
+
+
+if __name__ == "__main__":
+    main()
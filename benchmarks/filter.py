@@ -0,0 +1,79 @@
+# Этап фильтров на синтетическом снимке: исходный код (df.copy() и цепочка булевых индексаций,
+# KPI по отфильтрованному кадру, сортировка копии для таблицы) против filter_reviews + позиций строк.
+# Окно "последние 90 дней", все источники, все оценки; результаты обоих путей сверяются.
+#   python benchmarks/filter.py 100000 1000000 5000000
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import stand_in
+
+PAGE_ROWS = 10
+
+
+def copy_and_mask(df, app, period_start, sources, rating_range):
+    # Исходный путь страницы
+    filtered_df = df.copy()
+    filtered_df = filtered_df[filtered_df['review_date'] >= period_start]
+    filtered_df = filtered_df[filtered_df['source'].isin(sources)]
+    filtered_df = filtered_df[(filtered_df['rating'] >= rating_range[0]) & (filtered_df['rating'] <= rating_range[1])]
+    total_reviews = len(filtered_df)
+    positive = len(filtered_df[filtered_df['rating'] >= 4])
+    negative = len(filtered_df[filtered_df['rating'] <= 2])
+    responses = int(filtered_df['has_response'].sum())
+    unique_authors = filtered_df['author'].nunique()
+    table_df = filtered_df.copy()
+    table_df = table_df.sort_values('review_date', ascending=False)
+    page = table_df.head(PAGE_ROWS)
+    return total_reviews, positive, negative, responses, unique_authors, page['review_date'].tolist()
+
+
+def positions(df, app, period_start, sources, rating_range):
+    idx = app['filter_reviews'](df, period_start, None, sources, rating_range)
+    ratings = app['take'](df, idx, 'rating')
+    total_reviews = len(idx)
+    positive = int(np.count_nonzero(ratings >= 4))
+    negative = int(np.count_nonzero(ratings <= 2))
+    responses = int(app['take'](df, idx, 'has_response').sum())
+    # Уникальные авторы - bincount по кодам категории, без хеширования строк
+    unique_authors = int(np.count_nonzero(np.bincount(df['author'].cat.codes.to_numpy()[idx])))
+    page = df.iloc[app['page_positions'](df, idx, "Дата ↓", 0, PAGE_ROWS)]
+    return total_reviews, positive, negative, responses, unique_authors, page['review_date'].tolist()
+
+
+def measure(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int, nargs="*", default=[100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+    app = stand_in.load_app()
+    period_start = datetime.now() - timedelta(days=90)
+    print("Последние 90 дней, все источники, оценки 1-5: фильтр + KPI + страница таблицы, лучший из 3")
+    for rows in args.rows:
+        df = stand_in.make_snapshot(rows)
+        old = measure(copy_and_mask, df, app, period_start, stand_in.SOURCES, (1, 5))
+        new = measure(positions, df, app, period_start, stand_in.SOURCES, (1, 5))
+        assert old[2] == new[2], "результаты путей расходятся"
+        print(
+            f"{rows:>10,} строк: {old[0] * 1000:7.0f} мс -> {new[0] * 1000:5.0f} мс, "
+            f"пик аллокаций {old[1] / 2 ** 20:5.0f} МБ -> {new[1] / 2 ** 20:3.0f} МБ"
+        )
+
+
+if __name__ == "__main__":
+    main()
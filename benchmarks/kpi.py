@@ -0,0 +1,74 @@
+# KPI карточек и графика тональности по строкам: исходный код (отдельная булева маска и копия
+# кадра на каждый показатель, ответы по колонке bank_response) против compute_kpis
+# (один bincount оценок + сумма флагов ответа) с точным числом авторов по кодам категории.
+#   python benchmarks/kpi.py 100000 1000000 5000000
+import argparse
+import time
+
+import numpy as np
+
+import stand_in
+
+
+def multi_mask(f):
+    # Исходный путь страницы
+    total_reviews = len(f)
+    avg_rating = f['rating'].mean()
+    positive = len(f[f['rating'] >= 4])
+    negative = len(f[f['rating'] <= 2])
+    positive_pct = (positive / total_reviews * 100) if total_reviews > 0 else 0
+    responses = f['bank_response'].notna().sum()
+    response_rate = (responses / total_reviews * 100) if total_reviews > 0 else 0
+    unique_authors = f['author'].nunique()
+    promoters = len(f[f['rating'] >= 4])
+    detractors = len(f[f['rating'] <= 2])
+    nps = ((promoters - detractors) / total_reviews * 100) if total_reviews > 0 else 0
+    sentiment_data = {
+        'Позитивные': len(f[f['rating'] >= 4]),
+        'Нейтральные': len(f[f['rating'] == 3]),
+        'Негативные': len(f[f['rating'] <= 2]),
+    }
+    return (
+        total_reviews, round(avg_rating, 9), positive, negative, round(positive_pct, 9), int(responses),
+        round(response_rate, 9), unique_authors, round(nps, 9), tuple(sentiment_data.values()),
+    )
+
+
+def single_pass(f, app):
+    codes = f['author'].cat.codes.to_numpy()
+    unique_authors = int(np.count_nonzero(np.bincount(codes[codes >= 0])))
+    k = app['compute_kpis'](f['rating'].to_numpy(), responses=f['has_response'].to_numpy(), unique_authors=unique_authors)
+    return (
+        k['total'], round(k['avg_rating'], 9), k['positive'], k['negative'], round(k['positive_pct'], 9),
+        k['responses'], round(k['response_rate'], 9), k['unique_authors'], round(k['nps'], 9),
+        (k['positive'], k['neutral'], k['negative']),
+    )
+
+
+def best_of(function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int, nargs="*", default=[100_000, 1_000_000, 5_000_000])
+    args = parser.parse_args()
+    app = stand_in.load_app()
+    print("KPI по строкам, лучший из 5")
+    for rows in args.rows:
+        f = stand_in.make_snapshot(rows)
+        # Исходный код считал ответы по тексту ответа банка
+        f['bank_response'] = np.where(f['has_response'].to_numpy(), "Спасибо за отзыв", None)
+        old = best_of(lambda: multi_mask(f))
+        new = best_of(lambda: single_pass(f, app))
+        assert old[1] == new[1], (old[1], new[1])
+        print(f"{rows:>10,} строк: {old[0] * 1000:7.1f} мс -> {new[0] * 1000:6.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# Общее для бенчмарков: синтетическая таблица reviews, заглушка PostgREST в процессе
+# (подмножество клиента supabase-py, которым пользуется приложение) и загрузка функций приложения.
+# Задержка запроса имитирует сеть; max_rows - лимит строк ответа PostgREST (db-max-rows)
+import logging
+import os
+import re
+import runpy
+import sys
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "streamlit_app.py")
+SOURCES = ["banki.ru", "sravni.ru", "otzovik", "google", "yandex"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Самара", "Омск", "Пермь", "Уфа", ""]
+WORDS = (
+    "кэшбэк карта блокировка приложение кредит вклад перевод отделение поддержка комиссия "
+    "хорошо плохо ужасно отлично быстро долго"
+).split()
+
+
+# ============= ДАННЫЕ =============
+def make_reviews(n, days=400, seed=0):
+    # Строки в том виде, в каком их отдает PostgREST: даты - строки ISO, пропуски - None
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now().floor("h")
+    dates = now - pd.to_timedelta(rng.integers(0, days * 86400, n), unit="s")
+    words = np.array(WORDS, dtype=object)
+    return pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "review_date": dates.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rating": rng.integers(1, 6, n).astype(float),
+        "source": rng.choice(SOURCES, n),
+        "author": np.array([f"user{i}" for i in rng.integers(0, max(n // 3, 1), n)], dtype=object),
+        "author_location": rng.choice(np.array(CITIES, dtype=object), n),
+        "bank_response": np.where(rng.random(n) < 0.4, "Спасибо за отзыв", None),
+        "review_text": [" ".join(rng.choice(words, 12)) for _ in range(n)],
+        "updated_at": dates.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+
+
+def make_snapshot(n, days=1000, seed=0, cities=300):
+    # Кадр в том виде, в каком его держит приложение (после _normalize и сортировки по дате):
+    # строится напрямую, без строк PostgREST - так быстрее на миллионах строк
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now().floor("s")
+    authors = max(n // 3, 1)
+    df = pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "review_date": now - pd.to_timedelta(rng.integers(0, days * 86400, n), unit="s"),
+        "rating": rng.integers(1, 6, n).astype(np.int8),
+        "source": pd.Categorical.from_codes(rng.integers(0, len(SOURCES), n), SOURCES),
+        "author": pd.Categorical.from_codes(rng.integers(0, authors, n), [f"user{i}" for i in range(authors)]),
+        "author_location": pd.Categorical.from_codes(
+            rng.integers(0, cities, n), [f"Город {i}" for i in range(cities)]
+        ),
+        "updated_at": now - pd.to_timedelta(rng.integers(0, days * 86400, n), unit="s"),
+        "has_response": rng.random(n) < 0.4,
+    })
+    df = df.sort_values("review_date", kind="stable", ignore_index=True)
+    df["review_day"] = df["review_date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    return df
+
+
+def load_app():
+    # Функции приложения без сервера Streamlit: скрипт выполняется целиком в "голом" режиме,
+    # без секретов подключения страница ничего не загружает
+    sys.path.insert(0, ROOT)
+    logging.disable(logging.WARNING)
+    warnings.filterwarnings("ignore")
+    return runpy.run_path(APP_PATH, run_name="benchmark")
+
+
+# ============= ЗАГЛУШКА POSTGREST =============
+class Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class Query:
+    # Условия копятся до execute: условия на id сужают срез строк бинарным поиском (как индекс
+    # первичного ключа), остальные проверяются только внутри среза
+    def __init__(self, client):
+        self.client = client
+        self.columns = None
+        self.lo, self.hi = 0, len(client.df)
+        self.conditions = []
+        self.negate = False
+        self.count = None
+        self.orders = []
+        self.limit_rows = None
+        self.window = None
+
+    def select(self, *columns, count=None):
+        columns = ",".join(columns)
+        self.columns = None if columns.strip() == "*" else [column.strip() for column in columns.split(",")]
+        self.count = count
+        return self
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def _add(self, condition):
+        if self.negate:
+            self.negate = False
+            self.conditions.append(lambda lo, hi: ~condition(lo, hi))
+        else:
+            self.conditions.append(condition)
+        return self
+
+    def _value(self, column, value):
+        if column in ("review_date", "updated_at"):
+            return pd.Timestamp(value).tz_localize(None)
+        if isinstance(value, str):
+            try:
+                return float(value) if "." in value else int(value)
+            except ValueError:
+                return value
+        return value
+
+    def _condition(self, column, op, value):
+        value = self._value(column, value)
+
+        def condition(lo, hi):
+            values = self.client.column(column).iloc[lo:hi]
+            result = {
+                "gt": values > value, "gte": values >= value, "lt": values < value,
+                "lte": values <= value, "eq": values == value, "neq": values != value,
+            }[op]
+            return result.fillna(False).to_numpy(dtype=bool) & values.notna().to_numpy()
+        return condition
+
+    def _compare(self, column, op, value):
+        if column == "id" and not self.negate and op in ("gt", "gte", "lt", "lte", "eq"):
+            ids = self.client.ids
+            value = int(value)
+            if op in ("gt", "gte", "eq"):
+                self.lo = max(self.lo, int(np.searchsorted(ids, value, "right" if op == "gt" else "left")))
+            if op in ("lt", "lte", "eq"):
+                self.hi = min(self.hi, int(np.searchsorted(ids, value, "left" if op == "lt" else "right")))
+            return self
+        return self._add(self._condition(column, op, value))
+
+    def gt(self, column, value):
+        return self._compare(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._compare(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._compare(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._compare(column, "lte", value)
+
+    def eq(self, column, value):
+        return self._compare(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._compare(column, "neq", value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._add(lambda lo, hi: self.client.df[column].iloc[lo:hi].isin(values).to_numpy())
+
+    def is_(self, column, value):
+        return self._add(lambda lo, hi: self.client.df[column].iloc[lo:hi].isna().to_numpy())
+
+    def filter(self, column, op, value):
+        # wfts: все слова запроса есть в тексте (без морфологии Postgres)
+        words = set(re.findall(r"[0-9a-zа-яё]+", value.lower()))
+
+        def condition(lo, hi):
+            texts = self.client.df[column].iloc[lo:hi].fillna("").str.lower().str.findall(r"[0-9a-zа-яё]+")
+            return np.array([words <= set(text) for text in texts], dtype=bool)
+        return self._add(condition)
+
+    def or_(self, expression):
+        parts = []
+        for part in re.findall(r'and\([^)]*\)|[^,]+', expression):
+            conditions = []
+            for item in part[4:-1].split(",") if part.startswith("and(") else [part]:
+                column, op, value = item.split(".", 2)
+                conditions.append(self._condition(column, op, value.strip('"')))
+            parts.append(conditions)
+
+        def condition(lo, hi):
+            mask = np.zeros(hi - lo, dtype=bool)
+            for conditions in parts:
+                both = np.ones(hi - lo, dtype=bool)
+                for single in conditions:
+                    both &= single(lo, hi)
+                mask |= both
+            return mask
+        return self._add(condition)
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, rows):
+        self.limit_rows = rows
+        return self
+
+    def range(self, start, end):
+        self.window = (start, end)
+        return self
+
+    def execute(self):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        with self.client.lock:
+            self.client.requests += 1
+        lo, hi = self.lo, max(self.lo, self.hi)
+        mask = np.ones(hi - lo, dtype=bool)
+        for condition in self.conditions:
+            mask &= condition(lo, hi)
+        positions = lo + np.flatnonzero(mask)
+        # Строки таблицы и так идут по id: сортировка нужна только для других порядков
+        if self.orders and self.orders != [("id", False)]:
+            keys = pd.DataFrame({
+                number: self.client.column(column).to_numpy()[positions]
+                for number, (column, _) in enumerate(self.orders)
+            })
+            order = keys.sort_values(
+                list(keys.columns), ascending=[not desc for _, desc in self.orders], kind="stable"
+            ).index.to_numpy()
+            positions = positions[order]
+        total = len(positions)
+        if self.window:
+            positions = positions[self.window[0]:self.window[1] + 1]
+        if self.limit_rows is not None:
+            positions = positions[:self.limit_rows]
+        if self.client.max_rows is not None:
+            positions = positions[:self.client.max_rows]
+        rows = self.client.df.iloc[positions]
+        if self.columns:
+            rows = rows[self.columns]
+        rows = rows.astype(object).where(rows.notna(), None)
+        return Response(rows.to_dict("records"), total if self.count else None)
+
+
+class RpcCall:
+    def __init__(self, client, function, params):
+        self.client = client
+        self.function = function
+        self.params = params
+
+    def execute(self):
+        if self.client.database is None:
+            raise RuntimeError("RPC требует Postgres: StandInClient(df, database=local_postgres(df))")
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        names = list(self.params)
+        arguments = ", ".join(f"{name} => %({name})s" for name in names)
+        with self.client.lock:
+            self.client.requests += 1
+            cursor = self.client.database.cursor()
+            cursor.execute(f"select public.{self.function}({arguments})", self.params)
+            return Response(cursor.fetchone()[0])
+
+
+class StandInClient:
+    def __init__(self, df, latency=0.0, max_rows=1000, database=None):
+        self.df = df.sort_values("id", ignore_index=True)
+        self.ids = self.df["id"].to_numpy()
+        self.latency = latency
+        self.max_rows = max_rows
+        self.database = database
+        self.requests = 0
+        self.parsed = {}
+        self.lock = threading.Lock()
+
+    def column(self, column):
+        # Даты разбираются один раз на клиента, а не в каждом запросе
+        if column not in self.parsed:
+            values = self.df[column]
+            self.parsed[column] = pd.to_datetime(values) if column in ("review_date", "updated_at") else values
+        return self.parsed[column]
+
+    def table(self, name):
+        return Query(self)
+
+    def rpc(self, function, params=None):
+        return RpcCall(self, function, params or {})
+
+
+# ============= POSTGRES ДЛЯ RPC =============
+# Функции режима server выполняет настоящий Postgres: локальный сервер pgserver
+# (pip install pgserver psycopg2-binary), таблица загружается из тех же синтетических строк
+MIGRATIONS = os.path.join(ROOT, "supabase", "migrations")
+TABLE_COLUMNS = [
+    "id", "review_date", "rating", "source", "author", "author_location", "review_text", "bank_response", "updated_at"
+]
+
+
+def local_postgres(df, data_dir=None):
+    import io
+    import pgserver
+    import psycopg2
+    server = pgserver.get_server(data_dir or os.path.join(ROOT, ".cache", "benchmark-pg"), cleanup_mode=None)
+    conn = psycopg2.connect(server.get_uri())
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("drop table if exists public.reviews cascade")
+    cursor.execute(
+        "create table public.reviews (id bigint primary key, review_date timestamptz, rating int, source text, "
+        "author text, author_location text, review_text text, bank_response text, updated_at timestamptz)"
+    )
+    buffer = io.StringIO()
+    df.assign(rating=df["rating"].astype("Int64"))[TABLE_COLUMNS].to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert(f"copy public.reviews ({','.join(TABLE_COLUMNS)}) from stdin with csv", buffer)
+    # Миграции агрегатов; поток изменений (realtime/notify) бенчмаркам не нужен
+    cursor.execute(open(os.path.join(MIGRATIONS, "20261018000000_review_aggregates.sql"), encoding="utf-8").read())
+    cursor.execute("analyze public.reviews")
+    return conn
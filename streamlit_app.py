@@ -6,6 +6,30 @@ from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 from supabase import create_client
 import numpy as np
+import plotly.io
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import os
+import json
+import gzip
+import hashlib
+import sys
+import copy
+import threading
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from collections import namedtuple, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain
+import multiprocessing
+from text_analysis import (
+    STOP_WORDS, stem_ru, split_words, tokenize, score_texts, get_sentiment_model,
+    NEGATIVE, NEUTRAL, POSITIVE, NO_OPINION,
+    minhash_texts, MINHASH_SIZE, MINHASH_VERSION, NO_SIGNATURE,
+)
 
 # ============= КОНФИГУРАЦИЯ =============
 st.set_page_config(
@@ -278,376 +302,3003 @@ def init_connection():
     except:
         return None
 
-@st.cache_data(ttl=60)
-def load_data():
-    client = init_connection()
-    if client:
-        try:
-            response = client.table("reviews").select("*").execute()
-            return pd.DataFrame(response.data)
-        except:
-            return pd.DataFrame()
-    return pd.DataFrame()
 
-# Загрузка данных
-df = load_data()
+def _setting(name, default):
+    # Необязательные ключи secrets; без secrets.toml подключения к базе все равно нет
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
 
-if not df.empty:
-    # ============= ПАНЕЛЬ ФИЛЬТРОВ =============
-    with st.container():
-        st.markdown('<div class="section-card">', unsafe_allow_html=True)
-        st.markdown("## 🔍 Панель управления фильтрами")
-        
-        # Выбор типа периода
-        period_type = st.radio(
-            "Тип периода",
-            ["Предустановленный", "Произвольные даты", "Относительный"],
-            horizontal=True,
-            help="Выберите способ фильтрации по времени"
-        )
-        
-        st.markdown("---")
-        
-        # Фильтры в зависимости от типа периода
-        if period_type == "Предустановленный":
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                period_preset = st.selectbox(
-                    "Выберите период",
-                    ["Сегодня", "Вчера", "Последние 7 дней", "Последние 30 дней", "Последние 90 дней", "Весь период"],
-                    index=2
-                )
-            
-            with col2:
-                sources_filter = st.multiselect(
-                    "Источники",
-                    options=df['source'].unique() if 'source' in df else [],
-                    default=df['source'].unique() if 'source' in df else []
-                )
-            
-            with col3:
-                rating_filter = st.select_slider(
-                    "Диапазон рейтингов",
-                    options=[1, 2, 3, 4, 5],
-                    value=(1, 5)
-                )
-            
-            with col4:
-                st.markdown("<br>", unsafe_allow_html=True)
-                if st.button("Применить фильтры", type="primary", use_container_width=True):
-                    st.cache_data.clear()
-                    st.rerun()
-        
-        elif period_type == "Произвольные даты":
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                if 'review_date' in df:
-                    min_date = pd.to_datetime(df['review_date']).min().date()
-                    max_date = pd.to_datetime(df['review_date']).max().date()
-                else:
-                    min_date = datetime.now().date() - timedelta(days=365)
-                    max_date = datetime.now().date()
-                
-                date_from = st.date_input(
-                    "Дата начала",
-                    value=max_date - timedelta(days=30),
-                    min_value=min_date,
-                    max_value=max_date,
-                    format="DD.MM.YYYY"
-                )
-            
-            with col2:
-                date_to = st.date_input(
-                    "Дата окончания",
-                    value=max_date,
-                    min_value=min_date,
-                    max_value=max_date,
-                    format="DD.MM.YYYY"
-                )
-            
-            with col3:
-                sources_filter = st.multiselect(
-                    "Источники",
-                    options=df['source'].unique() if 'source' in df else [],
-                    default=df['source'].unique() if 'source' in df else []
-                )
-            
-            with col4:
-                rating_filter = st.select_slider(
-                    "Рейтинги",
-                    options=[1, 2, 3, 4, 5],
-                    value=(1, 5)
-                )
-        
-        else:  # Относительный период
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                relative_value = st.number_input("Количество", min_value=1, max_value=365, value=30)
-            
-            with col2:
-                relative_unit = st.selectbox("Единица", ["дней", "недель", "месяцев"])
-            
-            with col3:
-                sources_filter = st.multiselect(
-                    "Источники",
-                    options=df['source'].unique() if 'source' in df else [],
-                    default=df['source'].unique() if 'source' in df else []
-                )
-            
-            with col4:
-                rating_filter = st.select_slider(
-                    "Рейтинги",
-                    options=[1, 2, 3, 4, 5],
-                    value=(1, 5)
-                )
-        
-        st.markdown('</div>', unsafe_allow_html=True)
-    
-    # ============= ПРИМЕНЕНИЕ ФИЛЬТРОВ =============
-    filtered_df = df.copy()
-    
-    # Преобразование дат
-    if 'review_date' in filtered_df:
-        filtered_df['review_date'] = pd.to_datetime(filtered_df['review_date'])
-        
-        # Фильтрация по периоду
-        if period_type == "Предустановленный":
-            if period_preset == "Сегодня":
-                filtered_df = filtered_df[filtered_df['review_date'].dt.date == datetime.now().date()]
-            elif period_preset == "Вчера":
-                filtered_df = filtered_df[filtered_df['review_date'].dt.date == (datetime.now() - timedelta(days=1)).date()]
-            elif period_preset == "Последние 7 дней":
-                filtered_df = filtered_df[filtered_df['review_date'] >= datetime.now() - timedelta(days=7)]
-            elif period_preset == "Последние 30 дней":
-                filtered_df = filtered_df[filtered_df['review_date'] >= datetime.now() - timedelta(days=30)]
-            elif period_preset == "Последние 90 дней":
-                filtered_df = filtered_df[filtered_df['review_date'] >= datetime.now() - timedelta(days=90)]
-        
-        elif period_type == "Произвольные даты":
-            filtered_df = filtered_df[
-                (filtered_df['review_date'].dt.date >= date_from) & 
-                (filtered_df['review_date'].dt.date <= date_to)
-            ]
-        
-        else:  # Относительный
-            days = relative_value
-            if relative_unit == "недель":
-                days = relative_value * 7
-            elif relative_unit == "месяцев":
-                days = relative_value * 30
-            filtered_df = filtered_df[filtered_df['review_date'] >= datetime.now() - timedelta(days=days)]
-    
-    # Фильтр по источникам
-    if sources_filter and 'source' in filtered_df:
-        filtered_df = filtered_df[filtered_df['source'].isin(sources_filter)]
-    
-    # Фильтр по рейтингу
-    if 'rating' in filtered_df:
-        filtered_df = filtered_df[(filtered_df['rating'] >= rating_filter[0]) & (filtered_df['rating'] <= rating_filter[1])]
-    
-    # ============= КЛЮЧЕВЫЕ МЕТРИКИ =============
-    st.markdown('<div class="section-card">', unsafe_allow_html=True)
-    st.markdown("## 📊 Ключевые показатели эффективности")
-    
-    col1, col2, col3, col4, col5, col6 = st.columns(6)
-    
-    # Расчет метрик
-    total_reviews = len(filtered_df)
-    avg_rating = filtered_df['rating'].mean() if 'rating' in filtered_df and not filtered_df.empty else 0
-    
-    if 'rating' in filtered_df and not filtered_df.empty:
-        positive = len(filtered_df[filtered_df['rating'] >= 4])
-        negative = len(filtered_df[filtered_df['rating'] <= 2])
-        positive_pct = (positive / total_reviews * 100) if total_reviews > 0 else 0
-    else:
-        positive_pct = 0
-    
-    if 'bank_response' in filtered_df:
-        responses = filtered_df['bank_response'].notna().sum()
-        response_rate = (responses / total_reviews * 100) if total_reviews > 0 else 0
-    else:
-        response_rate = 0
-    
-    unique_authors = filtered_df['author'].nunique() if 'author' in filtered_df else 0
-    
-    # NPS расчет (промоутеры - детракторы)
-    if 'rating' in filtered_df and not filtered_df.empty:
-        promoters = len(filtered_df[filtered_df['rating'] >= 4])
-        detractors = len(filtered_df[filtered_df['rating'] <= 2])
-        nps = ((promoters - detractors) / total_reviews * 100) if total_reviews > 0 else 0
+# ============= ПОСТРАНИЧНАЯ ЗАГРУЗКА =============
+# Размер страницы не больше PostgREST max-rows, иначе ответ молча обрезается
+PAGE_SIZE = 1000
+# Число параллельных потоков загрузки (запросы идут через общий пул соединений клиента)
+FETCH_WORKERS = 4
+# Ограничение на длину списка id в одном запросе in_(...)
+ID_BATCH_SIZE = 200
+
+# Узкий набор колонок для KPI и графиков; тексты догружаются только для видимых строк
+FACT_COLUMNS = ['id', 'review_date', 'rating', 'source', 'author', 'author_location']
+TEXT_COLUMNS = ['review_text', 'bank_response']
+# Повторяющиеся строковые значения храним как категории (коды + словарь)
+CATEGORY_COLUMNS = ['source', 'author', 'author_location']
+
+
+def _to_chunk(rows):
+    # Страница ответа сразу превращается в типизированный колоночный фрагмент
+    return _normalize(pd.DataFrame.from_records(rows))
+
+
+def _normalize(chunk):
+    for col in ('review_date', 'updated_at'):
+        if col in chunk:
+            chunk[col] = pd.to_datetime(chunk[col], format='ISO8601')
+            if chunk[col].dt.tz is not None:
+                chunk[col] = chunk[col].dt.tz_convert(None)
+    if 'review_date' in chunk:
+        # Номер дня от эпохи - для группировок по дням без .dt.date
+        chunk['review_day'] = chunk['review_date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    if 'rating' in chunk:
+        # Строки без оценки получают 0 и не попадают ни в один диапазон рейтингов
+        chunk['rating'] = pd.to_numeric(chunk['rating']).fillna(0).astype(np.int8)
+    for col in CATEGORY_COLUMNS:
+        if col in chunk:
+            chunk[col] = chunk[col].astype('category')
+    return chunk
+
+
+def _concat_reviews(frames):
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    # Категории склеиваются по кодам, иначе concat вернет object или будет хешировать словари.
+    # Общий словарь - словарь первого фрагмента плюс новые значения остальных: коды первого
+    # фрагмента (при дозагрузке это весь снимок) не пересчитываются
+    dtypes = {}
+    for col in CATEGORY_COLUMNS:
+        if all(col in frame for frame in frames):
+            base = frames[0][col].cat.categories
+            own = [frame[col].cat.categories for frame in frames[1:]]
+            lookups = [base.get_indexer(categories) for categories in own]
+            unseen = base[:0].append([
+                categories[lookup < 0] for categories, lookup in zip(own, lookups)
+            ]).unique()
+            dtypes[col] = frames[0][col].dtype if unseen.empty else pd.CategoricalDtype(base.append(unseen))
+            codes = [frames[0][col].cat.codes.to_numpy()]
+            for frame, categories, lookup in zip(frames[1:], own, lookups):
+                missing = lookup < 0
+                lookup[missing] = len(base) + unseen.get_indexer(categories[missing])
+                # Код -1 (пропуск) указывает на добавленный в конец -1
+                codes.append(np.append(lookup, -1)[frame[col].cat.codes.to_numpy()])
+            frames = [frame.assign(**{col: part}) for frame, part in zip(frames, codes)]
+    result = pd.concat(frames, ignore_index=True)
+    for col, dtype in dtypes.items():
+        result[col] = pd.Categorical.from_codes(result[col].to_numpy(), dtype=dtype)
+    return result
+
+
+def _sort_by_date(frame):
+    # Снимок хранится упорядоченным по дате: фильтр периода сводится к бинарному поиску.
+    # Отзывы без даты в снимок не попадают: фильтры периода их отбрасывали и раньше,
+    # а номер дня NaT (-2^63) ломает группировки по дням в кубе и рядах
+    if frame.empty or 'review_date' not in frame:
+        return frame
+    dated = frame['review_date'].notna()
+    if not dated.all():
+        frame = frame[dated]
+    return frame.sort_values('review_date', kind='stable', ignore_index=True)
+
+
+def _reviews_query(client, columns, where=None):
+    query = client.table("reviews").select(columns)
+    return where(query) if where else query
+
+
+def _probe_id(client, where, desc):
+    rows = _reviews_query(client, "id", where).order("id", desc=desc).limit(1).execute().data
+    return rows[0]["id"] if rows else None
+
+
+def _response_ids(client, where):
+    # Только id строк с непустым ответом банка - сам текст ответа не передается
+    ids = []
+    last_id = None
+    while True:
+        query = where(client.table("reviews").select("id")).neq("bank_response", "")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(PAGE_SIZE).execute().data
+        ids.extend(row["id"] for row in rows)
+        if len(rows) < PAGE_SIZE:
+            return ids
+        last_id = rows[-1]["id"]
+
+
+def _flag_responses(client, chunk, where):
+    chunk['has_response'] = chunk['id'].isin(_response_ids(client, where))
+    return chunk
+
+
+def _fetch_id_range(client, columns, after_id, until_id, where=None, response_flag=False):
+    # Keyset-пагинация: id > last_id ORDER BY id LIMIT N, без OFFSET
+    chunks = []
+    last_id = after_id
+    while True:
+        query = _reviews_query(client, columns, where).gt("id", last_id)
+        if until_id is not None:
+            query = query.lte("id", until_id)
+        rows = query.order("id").limit(PAGE_SIZE).execute().data
+        if not rows:
+            break
+        chunk = _to_chunk(rows)
+        if response_flag:
+            lo, hi = rows[0]["id"], rows[-1]["id"]
+            chunk = _flag_responses(client, chunk, lambda q: q.gte("id", lo).lte("id", hi))
+        chunks.append(chunk)
+        if len(rows) < PAGE_SIZE:
+            break
+        last_id = rows[-1]["id"]
+    return chunks
+
+
+def _after(query, after_id, where):
+    if where:
+        query = where(query)
+    return query.gt("id", after_id) if after_id is not None else query
+
+
+def fetch_reviews(client, columns="*", after_id=None, where=None, response_flag=False):
+    first_id = _probe_id(client, lambda q: _after(q, after_id, where), desc=False)
+    if first_id is None:
+        return pd.DataFrame()
+    last_id = _probe_id(client, lambda q: _after(q, after_id, where), desc=True)
+
+    # Диапазон id делится на равные отрезки, каждый листается в своем потоке
+    bounds = np.linspace(first_id - 1, last_id, FETCH_WORKERS + 1).astype(np.int64)
+    bounds = np.unique(bounds)
+    if last_id - first_id < PAGE_SIZE or len(bounds) < 3:
+        chunks = _fetch_id_range(client, columns, first_id - 1, last_id, where, response_flag)
     else:
-        nps = 0
-    
-    with col1:
-        st.metric(
-            label="Всего отзывов",
-            value=f"{total_reviews:,}",
-            delta="↑ 12%" if total_reviews > 10 else None
-        )
-    
-    with col2:
-        st.metric(
-            label="Средний рейтинг",
-            value=f"{avg_rating:.2f}",
-            delta="↑ 0.2" if avg_rating > 4 else "↓ 0.1"
-        )
-    
-    with col3:
-        st.metric(
-            label="Позитивные",
-            value=f"{positive_pct:.0f}%",
-            delta="↑ 5%" if positive_pct > 60 else "↓ 3%"
-        )
-    
-    with col4:
-        st.metric(
-            label="Ответы банка",
-            value=f"{response_rate:.0f}%",
-            delta="↑ 3%" if response_rate > 30 else None
-        )
-    
-    with col5:
-        st.metric(
-            label="Уникальных клиентов",
-            value=f"{unique_authors:,}"
-        )
-    
-    with col6:
-        st.metric(
-            label="NPS Score",
-            value=f"{nps:.0f}",
-            delta="↑ 8" if nps > 0 else "↓ 5"
-        )
-    
-    st.markdown('</div>', unsafe_allow_html=True)
-    
-    # ============= ГРАФИКИ - ПЕРВЫЙ РЯД =============
-    col1, col2 = st.columns([2, 1])
-    
-    with col1:
-        st.markdown('<div class="section-card">', unsafe_allow_html=True)
-        st.markdown("### 📈 Динамика отзывов и рейтингов")
-        
-        if 'review_date' in filtered_df and not filtered_df.empty:
-            daily_stats = filtered_df.groupby(filtered_df['review_date'].dt.date).agg({
-                'id': 'count',
-                'rating': 'mean'
-            }).reset_index()
-            daily_stats.columns = ['Дата', 'Количество', 'Средний рейтинг']
-            
-            fig = make_subplots(
-                rows=2, cols=1,
-                row_heights=[0.7, 0.3],
-                shared_xaxes=True,
-                vertical_spacing=0.03,
-                subplot_titles=('Количество отзывов', 'Средний рейтинг')
-            )
-            
-            # График количества
-            fig.add_trace(
-                go.Scatter(
-                    x=daily_stats['Дата'],
-                    y=daily_stats['Количество'],
-                    mode='lines+markers',
-                    name='Отзывы',
-                    line=dict(color=COLORS['primary'], width=2),
-                    marker=dict(size=6),
-                    fill='tozeroy',
-                    fillcolor=f"rgba(30, 64, 175, 0.1)"
-                ),
-                row=1, col=1
-            )
-            
-            # График рейтинга
-            fig.add_trace(
-                go.Bar(
-                    x=daily_stats['Дата'],
-                    y=daily_stats['Средний рейтинг'],
-                    name='Рейтинг',
-                    marker_color=COLORS['info'],
-                    opacity=0.8
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+            parts = pool.map(
+                lambda lo_hi: _fetch_id_range(
+                    client, columns, lo_hi[0], lo_hi[1], where, response_flag
                 ),
-                row=2, col=1
-            )
-            
-            fig.update_layout(
-                height=400,
-                showlegend=False,
-                hovermode='x unified',
-                plot_bgcolor='white',
-                paper_bgcolor='white',
-                font=dict(family="Inter", size=11, color=COLORS['text_secondary']),
-                margin=dict(l=0, r=0, t=30, b=0)
-            )
-            
-            fig.update_xaxes(
-                showgrid=True,
-                gridwidth=1,
-                gridcolor=COLORS['border'],
-                linecolor=COLORS['border']
-            )
-            fig.update_yaxes(
-                showgrid=True,
-                gridwidth=1,
-                gridcolor=COLORS['border'],
-                linecolor=COLORS['border']
+                zip(bounds[:-1].tolist(), bounds[1:].tolist())
             )
-            
-            st.plotly_chart(fig, use_container_width=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-    
-    with col2:
-        st.markdown('<div class="section-card">', unsafe_allow_html=True)
-        st.markdown("### ⭐ Распределение оценок")
-        
-        if 'rating' in filtered_df and not filtered_df.empty:
-            rating_dist = filtered_df['rating'].value_counts().sort_index()
-            
-            # Цвета для рейтингов
-            rating_colors = {
-                1: COLORS['danger'],
-                2: COLORS['warning'],
-                3: COLORS['secondary'],
-                4: COLORS['info'],
-                5: COLORS['success']
-            }
-            
-            fig = go.Figure(data=[
-                go.Bar(
-                    x=[f"{i}★" for i in range(1, 6)],
-                    y=[rating_dist.get(float(i), 0) for i in range(1, 6)],
-                    marker_color=[rating_colors[i] for i in range(1, 6)],
-                    text=[rating_dist.get(float(i), 0) for i in range(1, 6)],
-                    textposition='outside',
-                    textfont=dict(size=12, weight=600)
-                )
-            ])
-            
-            fig.update_layout(
-                height=400,
-                showlegend=False,
-                plot_bgcolor='white',
-                paper_bgcolor='white',
-                font=dict(family="Inter", size=11, color=COLORS['text_secondary']),
-                margin=dict(l=0, r=0, t=30, b=0),
-                yaxis_title="Количество",
-                xaxis_title=""
+            chunks = [chunk for part in parts for chunk in part]
+
+    # Одна конкатенация в конце вместо роста DataFrame по страницам
+    return _concat_reviews(chunks)
+
+
+def fetch_reviews_by_id(client, ids, columns="*", response_flag=False):
+    chunks = []
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        rows = client.table("reviews").select(columns).in_("id", batch).execute().data
+        if rows:
+            chunk = _to_chunk(rows)
+            if response_flag:
+                chunk = _flag_responses(client, chunk, lambda q: q.in_("id", batch))
+            chunks.append(chunk)
+    return _concat_reviews(chunks)
+
+
+def _has_column(client, column):
+    try:
+        client.table("reviews").select(column).limit(1).execute()
+        return True
+    except Exception:
+        return False
+
+
+# ============= СИНХРОНИЗАЦИЯ ДАННЫХ =============
+# Полная сверка с базой (удаления, пропущенные вставки) - не чаще, чем раз в интервал
+RECONCILE_INTERVAL = timedelta(minutes=15)
+# updated_at ставится в начале транзакции, а видна правка после фиксации: правка, зафиксированная
+# после прошлой дозагрузки, может получить метку раньше отметки. Такое окно перед отметкой перечитывается
+UPDATE_LAG = timedelta(minutes=5)
+# Снимок на диске в формате Arrow IPC: открывается через mmap без разбора и копирования колонок,
+# файл общий для всех процессов на хосте. Пустой путь отключает снимок.
+SNAPSHOT_PATH = _setting("SNAPSHOT_PATH", ".cache/reviews.arrow")
+SNAPSHOT_INTERVAL = timedelta(minutes=5)
+
+
+def write_snapshot(path, df, metadata):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        **{key.encode(): value.encode() for key, value in metadata.items()},
+    })
+    # Запись во временный файл рядом и атомарная подмена: читатели видят старый или новый файл целиком
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_snapshot(path):
+    # Колонки остаются представлениями отображенного файла (только для чтения);
+    # подмена файла писателем не затрагивает уже открытое отображение
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    metadata = {key.decode(): value.decode() for key, value in table.schema.metadata.items()}
+    return table.to_pandas(split_blocks=True), metadata
+
+
+# Период фонового обновления снимка (раньше - ttl кэша load_data)
+REFRESH_INTERVAL = timedelta(seconds=60)
+# Ручное обновление по кнопке - не чаще одного раза на процесс за интервал
+MANUAL_REFRESH_INTERVAL = timedelta(seconds=30)
+
+
+class RateLimit:
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = datetime.now()
+            if self.last is not None and now - self.last < self.interval:
+                return False
+            self.last = now
+            return True
+
+# Опубликованная версия данных: кадр и куб не меняются после публикации,
+# сессии читают их напрямую, без копий и без ожидания обновления
+ReviewState = namedtuple('ReviewState', ['df', 'cube', 'version', 'refreshed_at'])
+
+
+# Локальный снимок таблицы reviews, догружаемый по high-water mark
+class ReviewSync:
+    def __init__(self):
+        self.df = pd.DataFrame()
+        self.cube = ReviewCube(self.df)
+        self.state = ReviewState(self.df, None, None, None)
+        self.ready = threading.Event()
+        self.columns = None
+        self.last_id = None
+        self.last_updated_at = None
+        self.last_reconcile = None
+        self.lock = threading.Lock()
+        self.snapshot_path = SNAPSHOT_PATH
+        self.snapshot_version = None
+
+    def refresh(self, client):
+        with self.lock:
+            if self.df.empty and not self._open_snapshot():
+                self._full_load(client)
+            else:
+                self._load_delta(client)
+                if datetime.now() - self.last_reconcile >= RECONCILE_INTERVAL:
+                    self._reconcile(client)
+            return self._publish()
+
+    def apply(self, rows):
+        # События потока изменений: новые и измененные строки применяются к снимку и кубу инкрементально
+        with self.lock:
+            if self.columns is None:
+                # До первой загрузки события не нужны - их покроет сама загрузка
+                return self.state
+            delta = _to_chunk(rows)
+            if 'has_response' not in delta:
+                delta['has_response'] = delta.get('bank_response', pd.Series('', index=delta.index)).fillna('').ne('')
+            self._merge(delta[self.columns.split(",") + ['review_day', 'has_response']])
+            return self._publish()
+
+    def _publish(self):
+        # Публикация - одно присваивание: читатель видит либо старую, либо новую версию целиком
+        self.state = ReviewState(self.df, self.cube, self.cube.version, datetime.now())
+        return self.state
+
+    def _open_snapshot(self):
+        # Холодный старт со снимка: mmap файла + дельта с момента записи
+        if not self.snapshot_path:
+            return False
+        try:
+            df, metadata = read_snapshot(self.snapshot_path)
+        except (OSError, KeyError, ValueError):
+            return False
+        # Снимок со старым набором колонок игнорируется - будет полная загрузка
+        if df.empty or metadata.get("columns", "").split(",")[:len(FACT_COLUMNS)] != FACT_COLUMNS:
+            return False
+        # Снимок прежних версий мог сохранить отзывы без даты
+        if df['review_date'].isna().any():
+            return False
+        self.columns = metadata["columns"]
+        self.df = df
+        self.cube = ReviewCube(self.df)
+        self.last_reconcile = datetime.fromisoformat(metadata["reconciled_at"])
+        self.snapshot_version = self.cube.version
+        self._update_marks()
+        return True
+
+    def save_snapshot(self):
+        # Перезапись снимка - только после изменений; вызывается планировщиком не чаще SNAPSHOT_INTERVAL
+        with self.lock:
+            if not self.snapshot_path or self.df.empty or self.snapshot_version == self.cube.version:
+                return False
+            df, version = self.df, self.cube.version
+            metadata = {"columns": self.columns, "reconciled_at": self.last_reconcile.isoformat()}
+        # Запись идет вне блокировки: кадр опубликован и больше не меняется
+        write_snapshot(self.snapshot_path, df, metadata)
+        self.snapshot_version = version
+        return True
+
+    def _full_load(self, client):
+        columns = list(FACT_COLUMNS)
+        if _has_column(client, "updated_at"):
+            columns.append("updated_at")
+        self.columns = ",".join(columns)
+        loaded = fetch_reviews(client, self.columns, response_flag=True)
+        self.df = _sort_by_date(loaded)
+        self.cube = ReviewCube(self.df)
+        self.last_reconcile = datetime.now()
+        self._update_marks(loaded)
+
+    def _load_delta(self, client):
+        # Новые строки по id, измененные - по updated_at (если колонка есть в таблице)
+        if self.last_updated_at is not None:
+            since = self.last_updated_at - UPDATE_LAG
+            mark = since.isoformat()
+            delta = fetch_reviews(
+                client, self.columns, response_flag=True,
+                where=lambda q: q.or_(f"id.gt.{self.last_id},updated_at.gt.\"{mark}\"")
             )
-            
-            fig.update_xaxes(linecolor=COLORS['border'])
-            fig.update_yaxes(
-                showgrid=True,
-                gridwidth=1,
-                gridcolor=COLORS['border'],
-                linecolor=COLORS['border']
+            # Уже загруженные версии строк из окна отбрасываются: без изменений версия не публикуется
+            if not delta.empty and not self.df.empty:
+                recent = self.df[self.df["updated_at"] > since]
+                known = pd.MultiIndex.from_arrays([recent["id"], recent["updated_at"]])
+                delta = delta[~pd.MultiIndex.from_arrays([delta["id"], delta["updated_at"]]).isin(known)]
+        else:
+            delta = fetch_reviews(client, self.columns, after_id=self.last_id, response_flag=True)
+        self._merge(delta)
+
+    def _reconcile(self, client):
+        # Отзывы без даты в снимке не хранятся - и в сверке не участвуют
+        server_ids = pd.Index(
+            fetch_reviews(client, columns="id", where=lambda q: q.not_.is_("review_date", "null")).get("id", [])
+        )
+        # Удаленные на сервере строки убираем из снимка и из куба
+        alive = self.df["id"].isin(server_ids)
+        removed = self.df[~alive]
+        self.df = self.df[alive].reset_index(drop=True)
+        self._update_cube(removed=removed)
+        # Строки, вставленные "в прошлое" (id ниже high-water mark), догружаем отдельно
+        missing = server_ids.difference(pd.Index(self.df["id"]))
+        if len(missing):
+            self._merge(fetch_reviews_by_id(client, missing.tolist(), self.columns, response_flag=True))
+        self.last_reconcile = datetime.now()
+
+    def _merge(self, delta):
+        if delta.empty:
+            return
+        # Старые версии измененных строк вычитаются из куба, новые - добавляются
+        replaced = self.df[self.df["id"].isin(delta["id"])] if not self.df.empty else self.df
+        delta = delta.drop_duplicates("id", keep="last")
+        if replaced.empty and not self.df.empty and delta["review_date"].min() >= self.df["review_date"].iloc[-1]:
+            # Обычный поток новых отзывов: строки дописываются в конец без пересортировки снимка
+            size = len(self.df)
+            self.df = _concat_reviews([self.df, _sort_by_date(delta)])
+            added = self.df.iloc[size:]
+        else:
+            self.df = _sort_by_date(
+                _concat_reviews([self.df, delta]).drop_duplicates("id", keep="last")
             )
-            
-            st.plotly_chart(fig, use_container_width=True)
-        st.markdown('</div>', unsafe_allow_html=True)
-    
+            added = self.df[self.df["id"].isin(delta["id"])]
+        self._update_cube(added=added, removed=replaced)
+        self._update_marks(delta)
+
+    def _update_cube(self, added=None, removed=None):
+        # Опубликованный куб читают сессии, поэтому изменения идут в копию
+        # (update заменяет атрибуты новыми объектами, поверхностной копии достаточно)
+        cube = copy.copy(self.cube)
+        cube.update(self.df, added=added, removed=removed)
+        self.cube = cube
+
+    def _update_marks(self, fetched=None):
+        # Отметки учитывают и полученные строки, не попавшие в снимок (без даты): иначе они
+        # загружались бы заново при каждом обновлении
+        frames = [frame for frame in (self.df, fetched) if frame is not None and not frame.empty]
+        if not frames:
+            return
+        self.last_id = max(frame["id"].max() for frame in frames)
+        if "updated_at" in frames[0]:
+            self.last_updated_at = max(frame["updated_at"].max() for frame in frames)
+
+
+@st.cache_resource
+def get_review_sync():
+    return ReviewSync()
+
+
+def load_data():
+    get_scheduler()
+    sync = get_review_sync()
+    # Ждать приходится только первой загрузки процесса
+    if not sync.ready.is_set():
+        with st.spinner("Загрузка данных..."):
+            sync.ready.wait()
+    return sync.state
+
+
+@st.cache_resource
+def get_refresh_limit():
+    return RateLimit(MANUAL_REFRESH_INTERVAL)
+
+
+# Полные тексты отзывов и ответов - только по id видимых строк
+@st.cache_data(ttl=300, max_entries=64)
+def load_review_texts(ids):
+    client = init_connection()
+    if client and ids:
+        try:
+            return fetch_reviews_by_id(client, list(ids), ",".join(['id'] + TEXT_COLUMNS))
+        except Exception:
+            pass
+    return pd.DataFrame(columns=['id'] + TEXT_COLUMNS)
+
+
+# ============= ФИЛЬТРАЦИЯ =============
+# Фильтры не копируют кадр: результатом служит массив позиций строк,
+# секции ниже берут из кадра только нужные им колонки по этим позициям
+def period_slice(df, period_start, period_end):
+    # Кадр отсортирован по review_date, границы периода ищутся за O(log n)
+    dates = df['review_date'].to_numpy()
+    lo = 0 if period_start is None else int(np.searchsorted(dates, np.datetime64(period_start), 'left'))
+    hi = len(dates) if period_end is None else int(np.searchsorted(dates, np.datetime64(period_end), 'left'))
+    return lo, max(lo, hi)
+
+
+def filter_reviews(df, period_start, period_end, sources, rating_range):
+    lo, hi = period_slice(df, period_start, period_end) if 'review_date' in df else (0, len(df))
+    # Остальные условия проверяются только внутри среза периода (срезы - представления, без копий)
+    mask = np.ones(hi - lo, dtype=bool)
+    if sources and 'source' in df:
+        # Таблица допустимых кодов категорий вместо сравнения строк
+        allowed = np.append(df['source'].cat.categories.isin(list(sources)), False)
+        mask &= allowed[df['source'].cat.codes.to_numpy()[lo:hi]]
+    if 'rating' in df:
+        ratings = df['rating'].to_numpy()[lo:hi]
+        mask &= (ratings >= rating_range[0]) & (ratings <= rating_range[1])
+    return lo + np.flatnonzero(mask)
+
+
+def take(df, idx, column):
+    return df[column].to_numpy()[idx]
+
+
+# Размеры страницы таблицы: больше 100 строк st.dataframe прокручивает сам, отрисовывая только видимые
+TABLE_PAGE_SIZES = [10, 25, 50, 100, 500]
+
+
+# Блок, которым ищутся позиции страницы внутри группы оценок
+PAGE_SCAN_BLOCK = 1 << 14
+
+
+def _true_positions(mask, first, last):
+    # Позиции совпадений с номерами [first, last): совпадения считаются по блокам,
+    # сами позиции достаются только из блоков, где лежит страница
+    starts = np.arange(0, len(mask), PAGE_SCAN_BLOCK)
+    ends = np.cumsum(np.add.reduceat(mask, starts, dtype=np.int64))
+    lo = int(np.searchsorted(ends, first, 'right'))
+    hi = int(np.searchsorted(ends, last - 1, 'right'))
+    before = int(ends[lo - 1]) if lo else 0
+    hits = np.flatnonzero(mask[starts[lo]:starts[hi] + PAGE_SCAN_BLOCK]) + starts[lo]
+    return hits[first - before:last - before]
+
+
+# Позиции одной страницы таблицы без сортировки всей выборки. Оценок всего несколько значений:
+# группы оценок идут в порядке сортировки, внутри группы позиции уже упорядочены по дате -
+# тот же порядок, что у устойчивой сортировки, поэтому из группы берется только окно страницы
+def page_positions(df, idx, sort_option, offset, limit, scores=None):
+    stop = min(offset + limit, len(idx))
+    if offset >= stop:
+        return idx[:0]
+    if sort_option == "Релевантность":
+        # Совпадений поиска немного - полная сортировка по BM25, при равной оценке сначала новые
+        return idx[::-1][np.argsort(-scores[::-1], kind='stable')[offset:stop]]
+    if sort_option == "Дата ↓":
+        # Позиции уже идут по возрастанию даты
+        return idx[len(idx) - stop:len(idx) - offset][::-1]
+    ratings = take(df, idx, 'rating')
+    top = int(ratings.max())
+    levels = range(top, -1, -1) if sort_option == "Рейтинг ↓" else range(top + 1)
+    parts = []
+    start = 0
+    for level in levels:
+        if start >= stop:
+            break
+        match = ratings == level
+        end = start + int(np.count_nonzero(match))
+        if end > max(offset, start):
+            parts.append(idx[_true_positions(match, max(offset - start, 0), min(stop, end) - start)])
+        start = end
+    return np.concatenate(parts)
+
+
+# Все KPI за один проход: распределение оценок через bincount + одна сумма ответов.
+# weights - число отзывов в ячейке куба (None для построчного расчета).
+def compute_kpis(ratings, weights=None, responses=None, unique_authors=0):
+    rating_counts = np.bincount(ratings, weights=weights, minlength=6).astype(np.int64)
+    total = int(rating_counts.sum())
+    positive = int(rating_counts[4:].sum())
+    neutral = int(rating_counts[3])
+    negative = int(rating_counts[1:3].sum())
+    response_count = int(responses.sum()) if responses is not None else 0
+    share = (lambda value: value / total * 100) if total > 0 else (lambda value: 0)
+    return {
+        'total': total,
+        'rating_counts': rating_counts,
+        'avg_rating': (rating_counts * np.arange(6)).sum() / total if total > 0 else 0,
+        'positive': positive,
+        'neutral': neutral,
+        'negative': negative,
+        'positive_pct': share(positive),
+        # NPS: промоутеры (4-5) минус детракторы (1-2)
+        'nps': share(positive - negative),
+        'responses': response_count,
+        'response_rate': share(response_count),
+        'unique_authors': unique_authors,
+    }
+
+
+def sum_by_category(df, cells, column):
+    # Ячейки куба хранят коды категорий, подписи берутся из словаря кадра
+    categories = df[column].cat.categories
+    counts = np.bincount(
+        cells[column].to_numpy() + 1, weights=cells['reviews'].to_numpy(), minlength=len(categories) + 1
+    )
+    counts = pd.Series(counts[1:].astype(np.int64), index=categories)
+    return counts[counts > 0].sort_values(ascending=False)
+
+
+def sum_by_day(cells, column):
+    days = cells['review_day'].to_numpy()
+    first_day = days.min()
+    sums = np.bincount(days - first_day, weights=cells[column].to_numpy())
+    present = np.bincount(days - first_day, weights=cells['reviews'].to_numpy()) > 0
+    return pd.Series(sums[present], index=np.flatnonzero(present) + first_day)
+
+
+# ============= HYPERLOGLOG =============
+# Уникальные авторы считаются по скетчам HLL: регистры хранятся на каждую ячейку
+# дневного куба и объединяются поэлементным максимумом за любой период и набор источников
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+# Относительная стандартная ошибка оценки
+HLL_ERROR = 1.04 / np.sqrt(HLL_REGISTERS)
+
+
+def _leading_zeros(values):
+    # Точное число ведущих нулей 64-битных значений, бинарным поиском по сдвигам
+    values = values.copy()
+    zeros = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = values >> np.uint64(64 - shift) == 0
+        zeros += high * shift
+        values = np.where(high, values << np.uint64(shift), values)
+    return zeros + (values >> np.uint64(63) == 0)
+
+
+def hll_observations(hashes):
+    # Старшие биты хэша - номер регистра, позиция первой единицы в остатке - значение
+    index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = (hashes << np.uint64(HLL_PRECISION)) | np.uint64(1 << (HLL_PRECISION - 1))
+    return index, (_leading_zeros(rest) + 1).astype(np.uint8)
+
+
+def author_observations(codes):
+    # Словарь авторов в снимке только дополняется, поэтому код категории - устойчивый
+    # идентификатор автора на все время жизни куба; хэшируются коды, а не строки
+    codes = codes[codes >= 0].astype(np.int64)
+    return hll_observations(pd.util.hash_array(codes))
+
+
+def hll_estimate(registers):
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.exp2(-registers.astype(np.float64)).sum()
+    zeros = int(np.count_nonzero(registers == 0))
+    # Для малых множеств точнее линейный подсчет по пустым регистрам
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def _cell_keys(days, sources, ratings):
+    # Ключ ячейки упорядочен так же, как строки куба: день, источник, оценка
+    return (
+        (days.astype(np.int64) << 20)
+        + ((sources.astype(np.int64) + 1) << 3)
+        + ratings.astype(np.int64)
+    )
+
+
+# ============= АГРЕГАТЫ =============
+# Дневные агрегаты: KPI и графики считаются по ним, а не по строкам отзывов.
+# Полный куб с городами заметно больше, поэтому KPI идут по свертке без городов.
+DAILY_DIMENSIONS = ['review_day', 'source', 'rating']
+GEO_DIMENSIONS = ['review_day', 'source', 'rating', 'author_location']
+MEASURES = ['reviews', 'responses']
+
+
+def _cells(frame, dimensions):
+    # Каждая строка - ячейка с весом 1; суммирование делают потребители
+    cells = pd.DataFrame({
+        col: frame[col].cat.codes.to_numpy() if col in CATEGORY_COLUMNS else frame[col].to_numpy()
+        for col in dimensions
+    })
+    cells['reviews'] = 1
+    cells['responses'] = frame['has_response'].to_numpy().astype(np.int64)
+    return cells
+
+
+def _aggregate(frame, dimensions):
+    if frame.empty:
+        return pd.DataFrame(columns=dimensions + MEASURES, dtype=np.int64)
+    return _cells(frame, dimensions).groupby(dimensions, sort=True).sum().reset_index()
+
+
+def _combine(parts, dimensions):
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return pd.DataFrame(columns=dimensions + MEASURES, dtype=np.int64)
+    cube = pd.concat(parts).groupby(dimensions, sort=True)[MEASURES].sum().reset_index()
+    return cube[cube['reviews'] > 0].reset_index(drop=True)
+
+
+def _with_location(frame):
+    # Пустые города на график географии не попадают
+    if frame.empty:
+        return frame
+    location = frame['author_location']
+    return frame[location.notna() & (location != '')]
+
+
+class ReviewCube:
+    def __init__(self, df):
+        self.daily = _aggregate(df, DAILY_DIMENSIONS)
+        self.geo = _aggregate(_with_location(df), GEO_DIMENSIONS)
+        # Скетчи HLL авторов: строка регистров на каждую строку self.daily
+        self.authors = np.zeros((len(self.daily), HLL_REGISTERS), dtype=np.uint8)
+        self._observe(df, self._daily_keys(), self.authors)
+        self.version = time.time_ns()
+
+    def update(self, df, added=None, removed=None):
+        # Обновление за O(куб + дельта): добавленные строки со знаком +, удаленные со знаком -
+        old_keys = self._daily_keys()
+        for name, dimensions, prepare in (
+            ('daily', DAILY_DIMENSIONS, lambda frame: frame),
+            ('geo', GEO_DIMENSIONS, _with_location),
+        ):
+            parts = [getattr(self, name)]
+            if added is not None and not added.empty:
+                parts.append(_aggregate(prepare(added), dimensions))
+            if removed is not None and not removed.empty:
+                negative = _aggregate(prepare(removed), dimensions)
+                negative[MEASURES] *= -1
+                parts.append(negative)
+            if len(parts) > 1:
+                setattr(self, name, _combine(parts, dimensions))
+        self._update_authors(df, old_keys, added, removed)
+        self.version = time.time_ns()
+
+    def _update_authors(self, df, old_keys, added, removed):
+        # Регистры переносятся на новые строки куба по ключу ячейки
+        keys = self._daily_keys()
+        registers = np.zeros((len(keys), HLL_REGISTERS), dtype=np.uint8)
+        if len(old_keys):
+            position = np.minimum(np.searchsorted(old_keys, keys), len(old_keys) - 1)
+            kept = old_keys[position] == keys
+            registers[kept] = self.authors[position[kept]]
+        # Из HLL нельзя вычесть автора: дни с удаленными строками пересобираются по снимку
+        if removed is not None and not removed.empty:
+            days = np.unique(removed['review_day'].to_numpy())
+            registers[np.isin(keys >> 20, days)] = 0
+            self._observe(df[np.isin(df['review_day'].to_numpy(), days)], keys, registers)
+        if added is not None:
+            self._observe(added, keys, registers)
+        self.authors = registers
+
+    def _daily_keys(self):
+        return _cell_keys(
+            self.daily['review_day'].to_numpy(), self.daily['source'].to_numpy(), self.daily['rating'].to_numpy()
+        )
+
+    def _observe(self, frame, keys, registers):
+        # Строки frame -> регистры ячеек с ключами keys
+        if frame.empty or 'author' not in frame:
+            return
+        codes = frame['author'].cat.codes.to_numpy()
+        valid = codes >= 0
+        rows = np.searchsorted(keys, _cell_keys(
+            frame['review_day'].to_numpy()[valid],
+            frame['source'].cat.codes.to_numpy()[valid],
+            frame['rating'].to_numpy()[valid],
+        ))
+        index, rho = author_observations(codes)
+        np.maximum.at(registers.reshape(-1), rows * HLL_REGISTERS + index, rho)
+
+    def unique_authors(self, df, period_start, period_end, sources, rating_range):
+        # Объединение скетчей целых дней + авторы неполных крайних дней
+        if 'author' not in df:
+            return 0
+        first_day, last_day, edges = split_period(period_start, period_end)
+        lo, hi = _day_range(self.daily['review_day'].to_numpy(), first_day, last_day)
+        merged = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+        selected = self.authors[lo:hi][_cell_mask(df, self.daily.iloc[lo:hi], sources, rating_range)]
+        if len(selected):
+            merged = selected.max(axis=0)
+        codes = df['author'].cat.codes.to_numpy()
+        for start, end in edges:
+            index, rho = author_observations(codes[filter_reviews(df, start, end, sources, rating_range)])
+            np.maximum.at(merged, index, rho)
+        return hll_estimate(merged)
+
+    def select(self, df, period_start, period_end, sources, rating_range):
+        # Целые дни периода берутся из куба, неполные крайние дни - из строк
+        first_day, last_day, edges = split_period(period_start, period_end)
+        edge_rows = [df.iloc[slice(*period_slice(df, start, end))] for start, end in edges]
+        result = []
+        for cube, dimensions, prepare in (
+            (self.daily, DAILY_DIMENSIONS, lambda frame: frame),
+            (self.geo, GEO_DIMENSIONS, _with_location),
+        ):
+            parts = [_cells(prepare(rows), dimensions) for rows in edge_rows]
+            lo, hi = _day_range(cube['review_day'].to_numpy(), first_day, last_day)
+            if hi > lo or not parts:
+                parts.append(cube.iloc[lo:hi])
+            # Ячейки не сворачиваются повторно: крайние дни добавляются как есть
+            part = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+            result.append(part[_cell_mask(df, part, sources, rating_range)])
+        return result
+
+
+def split_period(period_start, period_end):
+    # Период -> целые дни [first_day, last_day) + неполные крайние интервалы
+    first_day = None if period_start is None else _day_number(period_start, ceil=True)
+    last_day = None if period_end is None else _day_number(period_end)
+    if first_day is not None and last_day is not None and first_day >= last_day:
+        return first_day, first_day, [(period_start, period_end)]
+    edges = []
+    if first_day is not None and _day_start(first_day) > period_start:
+        edges.append((period_start, _day_start(first_day)))
+    if last_day is not None and _day_start(last_day) < period_end:
+        edges.append((_day_start(last_day), period_end))
+    return first_day, last_day, edges
+
+
+def _day_range(days, first_day, last_day):
+    # Позиции строк куба с днями [first_day, last_day)
+    lo = 0 if first_day is None else int(np.searchsorted(days, first_day, 'left'))
+    hi = len(days) if last_day is None else int(np.searchsorted(days, last_day, 'left'))
+    return lo, max(lo, hi)
+
+
+def _day_number(moment, ceil=False):
+    day = np.datetime64(moment, 'D')
+    if ceil and np.datetime64(moment) > day:
+        day += 1
+    return int(day.astype(np.int64))
+
+
+def _day_start(day):
+    return datetime(1970, 1, 1) + timedelta(days=day)
+
+
+def _cell_mask(df, cells, sources, rating_range):
+    ratings = cells['rating'].to_numpy()
+    mask = (ratings >= rating_range[0]) & (ratings <= rating_range[1])
+    if sources and 'source' in df:
+        allowed = np.append(df['source'].cat.categories.isin(list(sources)), False)
+        mask &= allowed[cells['source'].to_numpy()]
+    return mask
+
+
+# Префиксные суммы по дням: сумма за любой период и за предыдущий к нему - за O(1)
+class DailyTotals:
+    def __init__(self, df, cube, sources, rating_range):
+        cells = cube.daily[_cell_mask(df, cube.daily, sources, rating_range)]
+        days = cells['review_day'].to_numpy().astype(np.int64)
+        self.first_day = int(days.min()) if len(days) else 0
+        n_days = int(days.max()) - self.first_day + 1 if len(days) else 0
+        offsets = days - self.first_day
+        by_rating = np.bincount(
+            offsets * 6 + cells['rating'].to_numpy(),
+            weights=cells['reviews'].to_numpy(), minlength=n_days * 6
+        ).reshape(n_days, 6)
+        responses = np.bincount(offsets, weights=cells['responses'].to_numpy(), minlength=n_days)
+        self.rating_prefix = np.vstack([np.zeros((1, 6)), np.cumsum(by_rating, axis=0)])
+        self.response_prefix = np.concatenate([[0.0], np.cumsum(responses)])
+        self.sources = sources
+        self.rating_range = rating_range
+
+    def _position(self, day, default):
+        if day is None:
+            return default
+        return int(np.clip(day - self.first_day, 0, len(self.response_prefix) - 1))
+
+    def window(self, df, period_start, period_end):
+        # Целые дни - разность префиксов, неполные крайние дни - по строкам снимка
+        first_day, last_day, edges = split_period(period_start, period_end)
+        lo = self._position(first_day, 0)
+        hi = max(lo, self._position(last_day, len(self.response_prefix) - 1))
+        rating_counts = self.rating_prefix[hi] - self.rating_prefix[lo]
+        responses = self.response_prefix[hi] - self.response_prefix[lo]
+        for start, end in edges:
+            idx = filter_reviews(df, start, end, self.sources, self.rating_range)
+            rating_counts = rating_counts + np.bincount(take(df, idx, 'rating'), minlength=6)
+            responses += take(df, idx, 'has_response').sum()
+        return compute_kpis(np.arange(6), rating_counts, np.array([responses]))
+
+
+def get_daily_totals(cache, df, cube, sources, rating_range):
+    # Префиксы зависят только от источников и рейтингов - общие для всех периодов одной версии
+    key = ('totals',) + filter_key(cube.version, None, None, sources, rating_range)
+    return cache.get(key, lambda: DailyTotals(df, cube, list(sources), rating_range))
+
+
+def previous_period(period_start, period_end):
+    # Предыдущее окно той же длины, вплотную перед текущим
+    if period_start is None:
+        return None, None
+    end = period_end or datetime.now()
+    return period_start - (end - period_start), period_start
+
+
+def format_delta(current, previous, kind):
+    if previous is None:
+        return None
+    if kind == 'percent':
+        if not previous:
+            return None
+        return f"{round((current - previous) / previous * 100) + 0:+d}%"
+    if kind == 'rating':
+        return f"{round(current - previous, 2) + 0.0:+.2f}"
+    suffix = " п.п." if kind == 'points' else ""
+    return f"{round(current - previous) + 0:+d}{suffix}"
+
+
+# ============= ИСТОЧНИК АГРЕГАТОВ =============
+# "snapshot" - снимок таблицы в памяти процесса, KPI и графики считаются локально;
+# "server" - группировки выполняет Postgres (supabase/migrations), приходят только итоги
+DATA_BACKEND = _setting("DATA_BACKEND", "snapshot")
+LOCATION_LIMIT = 7
+
+
+def daily_frame(dates, reviews, rating_sums):
+    reviews = np.asarray(reviews, dtype=np.int64)
+    return pd.DataFrame({
+        'Дата': dates,
+        'Количество': reviews,
+        'Средний рейтинг': np.asarray(rating_sums, dtype=np.float64) / np.maximum(reviews, 1)
+    })
+
+
+def snapshot_overview(df):
+    if 'review_date' in df:
+        first_date, last_date = df['review_date'].min().date(), df['review_date'].max().date()
+    else:
+        last_date = datetime.now().date()
+        first_date = last_date - timedelta(days=365)
+    return {
+        'total': len(df),
+        'sources': df['source'].unique() if 'source' in df else [],
+        'first_date': first_date,
+        'last_date': last_date,
+    }
+
+
+def snapshot_view(df, cube, period_start, period_end, sources, rating_range, cache):
+    # KPI и графики считаются по ячейкам куба, строки нужны только таблице и выгрузке
+    daily_cells, geo_cells = cube.select(df, period_start, period_end, sources, rating_range)
+    
+    # KPI текущего и предыдущего окна - по префиксным суммам дней
+    totals = get_daily_totals(cache, df, cube, sources, rating_range)
+    kpis = totals.window(df, period_start, period_end)
+    kpis['unique_authors'] = cube.unique_authors(df, period_start, period_end, sources, rating_range)
+    
+    prev_start, prev_end = previous_period(period_start, period_end)
+    prev_kpis = None
+    if prev_start is not None:
+        prev_kpis = totals.window(df, prev_start, prev_end)
+        prev_kpis['unique_authors'] = cube.unique_authors(df, prev_start, prev_end, sources, rating_range)
+    
+    view = {
+        'kpis': kpis,
+        'prev_kpis': prev_kpis,
+        'daily': daily_frame([], [], []),
+        'sources': pd.Series(dtype=np.int64),
+        'locations': pd.Series(dtype=np.int64),
+    }
+    if kpis['total'] > 0:
+        day_reviews = sum_by_day(daily_cells, 'reviews')
+        day_ratings = sum_by_day(daily_cells.assign(rating=daily_cells['rating'] * daily_cells['reviews']), 'rating')
+        view['daily'] = daily_frame(pd.to_datetime(day_reviews.index, unit='D'), day_reviews, day_ratings)
+        if 'source' in df:
+            view['sources'] = sum_by_category(df, daily_cells, 'source')
+        if 'author_location' in df:
+            view['locations'] = sum_by_category(df, geo_cells, 'author_location').head(LOCATION_LIMIT)
+    return view
+
+
+# Результаты фильтров снимка (позиции строк + агрегаты) общие для всех сессий процесса;
+# в ключе версия данных, поэтому после обновления старые записи просто вытесняются.
+# Размер кэша ограничен объемом: позиции за весь период на больших таблицах - десятки МБ
+FILTER_CACHE_BYTES = 256 * 1024 ** 2
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, DailyTotals):
+        return _nbytes(vars(value))
+    return sys.getsizeof(value)
+
+
+class FilterCache:
+    def __init__(self, max_bytes, sizeof=_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        # Считается вне блокировки, чтобы разные фильтры не ждали друг друга
+        value = compute()
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if size <= self.max_bytes:
+                self.entries[key] = (value, size)
+                self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+
+@st.cache_resource
+def get_filter_cache():
+    return FilterCache(FILTER_CACHE_BYTES)
+
+
+def filter_key(version, period_start, period_end, sources, rating_range):
+    # Одинаковые представления дают один ключ независимо от порядка выбора источников
+    return (
+        version, period_start, period_end,
+        tuple(sorted(str(source) for source in sources)),
+        (int(rating_range[0]), int(rating_range[1])),
+    )
+
+
+def filtered_view(df, cube, period_start, period_end, sources, rating_range, cache=None):
+    # Фоновые задачи передают кэш явно: вне сессии st.cache_resource недоступен без предупреждений
+    if cache is None:
+        cache = get_filter_cache()
+    key = filter_key(cube.version, period_start, period_end, sources, rating_range)
+    return cache.get(key, lambda: (
+        # Один общий маск по периоду, источникам и рейтингу
+        filter_reviews(df, period_start, period_end, sources, rating_range),
+        snapshot_view(df, cube, period_start, period_end, sources, rating_range, cache),
+    ))
+
+
+# Позиции строк текущего и предыдущего окна для расчетов по строкам (тональность, повторы);
+# key - ключ фильтров окна для кэша производных результатов
+Window = namedtuple('Window', ['key', 'idx', 'prev_idx'])
+
+
+def review_window(df, cube, idx, period_start, period_end, sources, rating_range, cache=None):
+    if cache is None:
+        cache = get_filter_cache()
+    key = filter_key(cube.version, period_start, period_end, sources, rating_range)
+    
+    def previous():
+        prev_start, prev_end = previous_period(period_start, period_end)
+        if prev_start is None:
+            return None
+        return filter_reviews(df, prev_start, prev_end, sources, rating_range)
+    
+    return Window(key, idx, cache.get(('previous',) + key, previous))
+
+
+def window_kpis(df, idx, kpis):
+    # KPI по строкам окна (когда окно не совпадает с ячейками куба); уникальные авторы - из kpis
+    if kpis is None:
+        return None
+    return compute_kpis(
+        take(df, idx, 'rating'),
+        responses=take(df, idx, 'has_response') if 'has_response' in df else None,
+        unique_authors=kpis['unique_authors'],
+    )
+
+
+def _period_params(period_start, period_end, sources, rating_range):
+    return {
+        'period_start': None if period_start is None else period_start.isoformat(),
+        'period_end': None if period_end is None else period_end.isoformat(),
+        'sources': list(sources),
+        'rating_min': int(rating_range[0]),
+        'rating_max': int(rating_range[1]),
+    }
+
+
+def _server_filters(query, period_start, period_end, sources, rating_range):
+    # Те же условия, что и в review_dashboard, для выборок строк через PostgREST
+    if period_start is not None:
+        query = query.gte("review_date", period_start.isoformat())
+    if period_end is not None:
+        query = query.lt("review_date", period_end.isoformat())
+    if sources:
+        query = query.in_("source", list(sources))
+    return query.gte("rating", int(rating_range[0])).lte("rating", int(rating_range[1]))
+
+
+def _server_kpis(result):
+    rating_counts = np.zeros(6, dtype=np.int64)
+    for rating, count in result['ratings'].items():
+        rating_counts[int(rating)] = count
+    return compute_kpis(np.arange(6), rating_counts, np.array([result['responses']]), result['unique_authors'])
+
+
+def _ranking(rows):
+    return pd.Series([count for _, count in rows], index=[label for label, _ in rows], dtype=np.int64)
+
+
+@st.cache_data(ttl=60)
+def load_overview():
+    client = init_connection()
+    if client:
+        try:
+            result = client.rpc("review_overview", {}).execute().data
+            return {
+                'total': result['total'],
+                'sources': result['sources'],
+                'first_date': pd.Timestamp(result['first_review']).date(),
+                'last_date': pd.Timestamp(result['last_review']).date(),
+                'loaded_at': datetime.now(),
+            }
+        except Exception:
+            pass
+    return {'total': 0, 'sources': [], 'first_date': None, 'last_date': None, 'loaded_at': None}
+
+
+@st.cache_data(ttl=60)
+def load_server_view(period_start, period_end, sources, rating_range):
+    client = init_connection()
+    params = _period_params(period_start, period_end, sources, rating_range)
+    result = client.rpc("review_dashboard", {**params, 'location_limit': LOCATION_LIMIT}).execute().data
+    
+    prev_start, prev_end = previous_period(period_start, period_end)
+    prev_kpis = None
+    if prev_start is not None:
+        prev_params = _period_params(prev_start, prev_end, sources, rating_range)
+        prev_kpis = _server_kpis(client.rpc("review_kpis", prev_params).execute().data)
+    
+    daily = result['daily']
+    return {
+        'kpis': _server_kpis(result),
+        'prev_kpis': prev_kpis,
+        'daily': daily_frame(
+            pd.to_datetime([row[0] for row in daily]), [row[1] for row in daily], [row[2] for row in daily]
+        ),
+        'sources': _ranking(result['sources']),
+        'locations': _ranking(result['locations']),
+    }
+
+
+# Страница таблицы: фильтры, сортировка и окно строк уходят в запрос. Число строк (COUNT(*) по всему
+# отбору) запрашивается только с count=True, иначе вместо него None
+@st.cache_data(ttl=60, max_entries=64)
+def load_server_page(period_start, period_end, sources, rating_range, negative_only, with_response, search, sort_option, offset, limit, count=False):
+    client = init_connection()
+    if not client:
+        return pd.DataFrame(), 0
+    query = client.table("reviews").select(",".join(FACT_COLUMNS + TEXT_COLUMNS), count="exact" if count else None)
+    query = _server_filters(query, period_start, period_end, sources, rating_range)
+    if negative_only:
+        query = query.lte("rating", 2)
+    if with_response:
+        query = query.neq("bank_response", "")
+    if search:
+        # Полнотекстовый поиск Postgres по индексу из supabase/migrations (все слова запроса)
+        query = query.filter("review_text", "wfts(russian)", search)
+    # Порядок совпадает с режимом snapshot: при равных оценках - по дате и id
+    if sort_option == "Дата ↓":
+        query = query.order("review_date", desc=True).order("id", desc=True)
+    else:
+        query = query.order("rating", desc=sort_option == "Рейтинг ↓").order("review_date").order("id")
+    response = query.range(offset, offset + limit - 1).execute()
+    if not response.data:
+        return pd.DataFrame(), response.count
+    page = _to_chunk(response.data)
+    page['has_response'] = page['bank_response'].fillna('').astype(str) != ''
+    return page, response.count
+
+
+# ============= ВЫГРУЗКА =============
+# Файл выгрузки собирается только по клику и по частям: строки с текстами загружаются пачками
+# и дописываются в файл на диске, в памяти одновременно одна пачка. Готовый файл переиспользуется
+# для тех же фильтров: в режиме snapshot - пока не изменилась версия данных, в режиме server - EXPORT_TTL секунд
+EXPORT_DIR = _setting("EXPORT_DIR", ".cache/exports")
+EXPORT_CHUNK_ROWS = 20000
+EXPORT_TTL = 60
+# Сколько последних файлов хранится на диске
+EXPORT_KEEP = 8
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "CSV (gzip)": ("csv.gz", "application/gzip"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+# Типы колонок Parquet задаются заранее: у пачки без текстов колонка иначе получит тип null
+EXPORT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('review_date', pa.timestamp('ns')),
+    ('rating', pa.int8()),
+    ('source', pa.string()),
+    ('author', pa.string()),
+    ('author_location', pa.string()),
+    ('review_text', pa.string()),
+    ('bank_response', pa.string()),
+])
+
+
+def snapshot_export_chunks(df, idx):
+    client = init_connection()
+    columns = [col for col in FACT_COLUMNS if col in df]
+    for start in range(0, len(idx), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[idx[start:start + EXPORT_CHUNK_ROWS]][columns]
+        texts = pd.DataFrame({'id': pd.Series(dtype=np.int64), **{col: pd.Series(dtype=object) for col in TEXT_COLUMNS}})
+        if client:
+            texts = fetch_reviews_by_id(client, chunk['id'].tolist(), ",".join(['id'] + TEXT_COLUMNS))
+        yield chunk.merge(texts, on='id', how='left')
+
+
+def server_export_chunks(period_start, period_end, sources, rating_range):
+    # Листание по ключу (дата, id) вместо OFFSET: каждый запрос - поиск по индексу даты,
+    # а не пропуск всех предыдущих строк
+    client = init_connection()
+    if not client:
+        return
+    rows, last = [], None
+    while True:
+        query = client.table("reviews").select(",".join(FACT_COLUMNS + TEXT_COLUMNS))
+        query = _server_filters(query, period_start, period_end, sources, rating_range)
+        if last is not None:
+            query = query.or_(
+                f'review_date.gt."{last["review_date"]}",'
+                f'and(review_date.eq."{last["review_date"]}",id.gt.{last["id"]})'
+            )
+        page = query.order("review_date").order("id").limit(PAGE_SIZE).execute().data
+        rows.extend(page)
+        if rows and (not page or len(rows) >= EXPORT_CHUNK_ROWS):
+            yield _to_chunk(rows)
+            rows = []
+        if not page:
+            return
+        last = page[-1]
+
+
+def _export_frame(chunk):
+    # Категории - в обычные строки: словарь снимка не должен попадать в каждую пачку
+    chunk = chunk[[col for col in EXPORT_SCHEMA.names if col in chunk]]
+    return chunk.astype({col: object for col in CATEGORY_COLUMNS if col in chunk})
+
+
+def _write_export(path, chunks, extension):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if extension == "parquet":
+            writer = None
+            try:
+                for chunk in chunks:
+                    frame = _export_frame(chunk)
+                    if writer is None:
+                        schema = pa.schema([EXPORT_SCHEMA.field(col) for col in frame.columns])
+                        writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+                    writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+                if writer is None:
+                    pq.write_table(EXPORT_SCHEMA.empty_table(), tmp_path)
+            finally:
+                if writer is not None:
+                    writer.close()
+        else:
+            opener = gzip.open if extension.endswith(".gz") else open
+            with opener(tmp_path, "wt", encoding="utf-8", newline="") as file:
+                header = True
+                for chunk in chunks:
+                    _export_frame(chunk).to_csv(file, index=False, header=header)
+                    header = False
+                if header:
+                    file.write(",".join(EXPORT_SCHEMA.names) + "\n")
+        # Атомарная подмена: параллельная выгрузка тех же фильтров видит старый или новый файл целиком
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _prune_exports(keep_path):
+    paths = [
+        os.path.join(EXPORT_DIR, name) for name in os.listdir(EXPORT_DIR) if not name.endswith(".tmp")
+    ]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[EXPORT_KEEP:]:
+        if path != keep_path:
+            os.remove(path)
+
+
+def export_file(key, chunks, export_format, max_age=None):
+    # key - фильтры и версия данных; chunks - функция, возвращающая пачки строк
+    extension, _ = EXPORT_FORMATS[export_format]
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+    path = os.path.join(EXPORT_DIR, f"{digest}.{extension}")
+    if not os.path.exists(path) or (max_age is not None and time.time() - os.path.getmtime(path) > max_age):
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        _write_export(path, chunks(), extension)
+        _prune_exports(path)
+    # Кнопка скачивания передает браузеру байты: в память читается готовый, обычно сжатый файл
+    with open(path, "rb") as file:
+        return file.read()
+
+
+# ============= ТЕКСТЫ ОТЗЫВОВ =============
+# Текстов в снимке нет: их догружает отдельная фоновая задача и раздает обработчикам
+# (поисковый индекс, тональность). При старте - окнами по id, дальше - дельтами по id/updated_at, как снимок
+TEXT_LOAD_IDS = 50000
+
+
+class ReviewTexts:
+    def __init__(self, consumers):
+        # Обработчик получает пакет строк id/review_text[/updated_at] и признак начальной загрузки
+        self.consumers = consumers
+        self.columns = None
+        self.last_id = None
+        self.last_updated_at = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def update(self, client):
+        with self.lock:
+            if self.columns is None:
+                self._full_load(client)
+            elif self.last_updated_at is not None:
+                mark = self.last_updated_at.isoformat()
+                self._add(fetch_reviews(
+                    client, self.columns,
+                    where=lambda q: q.or_(f"id.gt.{self.last_id},updated_at.gt.\"{mark}\"")
+                ), initial=False)
+            else:
+                self._add(fetch_reviews(client, self.columns, after_id=self.last_id), initial=False)
+            self.ready.set()
+
+    def _full_load(self, client):
+        # Тексты целиком в память не поднимаются: окно id загружается, обрабатывается и отпускается,
+        # поиск работает по уже проиндексированной части
+        columns = "id,review_text"
+        if _has_column(client, "updated_at"):
+            columns += ",updated_at"
+        last_id = _probe_id(client, None, desc=True)
+        # После сбоя загрузка продолжается с последнего обработанного окна
+        after_id = self.last_id
+        if after_id is None and last_id is not None:
+            after_id = _probe_id(client, None, desc=False) - 1
+        if last_id is not None:
+            while after_id < last_id:
+                until_id = after_id + TEXT_LOAD_IDS
+                self._add(fetch_reviews(
+                    client, columns, after_id=after_id, where=lambda q: q.lte("id", until_id)
+                ), initial=True)
+                after_id = until_id
+        self.columns = columns
+        if self.last_id is None:
+            self.last_id = 0 if last_id is None else last_id
+
+    def _add(self, rows, initial):
+        if rows.empty:
+            return
+        rows = rows.drop_duplicates("id", keep="last")
+        for consumer in self.consumers:
+            consumer.add(rows, initial)
+        self.last_id = max(self.last_id or 0, int(rows['id'].max()))
+        if 'updated_at' in rows:
+            updated_at = rows['updated_at'].max()
+            if self.last_updated_at is None or updated_at > self.last_updated_at:
+                self.last_updated_at = updated_at
+
+
+@st.cache_resource
+def get_review_texts():
+    return ReviewTexts([get_search_index(), get_sentiment_store(), get_duplicate_index()])
+
+
+# Большие пакеты текстов делятся на пачки и обрабатываются в пуле процессов
+TEXT_BATCH = 5000
+TEXT_WORKERS = min(4, os.cpu_count() or 1)
+_text_pool = None
+
+
+def map_text_batches(func, texts):
+    # func - функция модуля text_analysis: пакет текстов -> кортеж массивов по отзывам
+    global _text_pool
+    batches = [texts[start:start + TEXT_BATCH] for start in range(0, len(texts), TEXT_BATCH)]
+    if len(batches) == 1 or TEXT_WORKERS < 2:
+        # Дельты между обновлениями малы - без передачи в другой процесс
+        results = [func(batch) for batch in batches]
+    else:
+        if _text_pool is None:
+            # fork, а не spawn/forkserver: те выполняют в каждом обработчике главный модуль процесса,
+            # а под Streamlit это скрипт приложения
+            _text_pool = ProcessPoolExecutor(TEXT_WORKERS, mp_context=multiprocessing.get_context("fork"))
+        try:
+            results = list(_text_pool.map(func, batches))
+        except BrokenProcessPool:
+            # Упавший обработчик ломает весь пул - следующий запуск задачи создаст новый
+            _text_pool = None
+            raise
+    if not isinstance(results[0], tuple):
+        return np.concatenate(results)
+    return tuple(np.concatenate(parts) for parts in zip(*results))
+
+
+ResultsState = namedtuple('ResultsState', ['ids', 'columns', 'version'])
+
+
+def locate_ids(sorted_ids, ids):
+    # Позиции id в отсортированном массиве и маска найденных
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    at = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return at, sorted_ids[at] == ids
+
+
+class ReviewResults:
+    # Результаты обработки текстов по id отзыва (тональность, подписи повторов) в файле рядом со снимком:
+    # после перезапуска заново обрабатываются только отзывы, новые или измененные с момента записи,
+    # дальше - только дельты. columns: имя -> (dtype, ширина); ширина 0 - одна колонка на отзыв
+    def __init__(self, path, model_version, columns):
+        self.path = path
+        self.model_version = model_version
+        self.schema = columns
+        self.state = ResultsState(np.empty(0, np.int64), {
+            name: np.empty((0, width) if width else 0, dtype) for name, (dtype, width) in columns.items()
+        }, 0)
+        # Отметка updated_at, до которой сохраненные результаты отражают изменения отзывов
+        self.processed_until = None
+        self.saved_version = 0
+        self.lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        if not self.path:
+            return
+        try:
+            frame, metadata = read_snapshot(self.path)
+            # Результаты другой версии модели не используются - корпус будет обработан заново
+            if frame.empty or metadata.get("model") != self.model_version:
+                return
+            columns = {}
+            for name, (dtype, width) in self.schema.items():
+                if width:
+                    columns[name] = np.column_stack([frame[f"{name}_{k}"].to_numpy(dtype) for k in range(width)])
+                else:
+                    columns[name] = frame[name].to_numpy(dtype)
+        except (OSError, KeyError, ValueError):
+            return
+        self.state = ResultsState(frame['id'].to_numpy(), columns, 1)
+        self.saved_version = 1
+        if metadata.get("processed_until"):
+            self.processed_until = pd.Timestamp(metadata["processed_until"])
+
+    def fresh(self, rows, initial):
+        # Строки, которые нужно обработать: при начальной загрузке сохраненные результаты
+        # не пересчитываются, кроме отзывов, измененных после записи
+        state = self.state
+        if not initial or not len(state.ids):
+            return rows
+        fresh = ~np.isin(rows['id'].to_numpy(), state.ids)
+        if self.processed_until is not None and 'updated_at' in rows:
+            fresh |= (rows['updated_at'] > self.processed_until).to_numpy()
+        return rows[fresh]
+
+    def upsert(self, rows, columns):
+        # Новые результаты заменяют прежние для тех же id; id хранятся по возрастанию для searchsorted
+        state = self.state
+        ids = rows['id'].to_numpy(dtype=np.int64)
+        kept = ~np.isin(state.ids, ids)
+        all_ids = np.concatenate([state.ids[kept], ids])
+        order = np.argsort(all_ids, kind='stable')
+        merged = {
+            name: np.concatenate([state.columns[name][kept], values])[order] for name, values in columns.items()
+        }
+        with self.lock:
+            self.state = ResultsState(all_ids[order], merged, state.version + 1)
+            if 'updated_at' in rows:
+                updated_at = rows['updated_at'].max()
+                if self.processed_until is None or updated_at > self.processed_until:
+                    self.processed_until = updated_at
+
+    def save(self):
+        # Вызывается задачей снимка: файл перезаписывается только после новых результатов
+        with self.lock:
+            state, processed_until = self.state, self.processed_until
+        if not self.path or state.version == self.saved_version or not len(state.ids):
+            return False
+        frame = {'id': state.ids}
+        for name, values in state.columns.items():
+            if values.ndim == 1:
+                frame[name] = values
+            else:
+                frame.update({f"{name}_{k}": values[:, k] for k in range(values.shape[1])})
+        write_snapshot(self.path, pd.DataFrame(frame), {
+            "model": self.model_version,
+            "processed_until": "" if processed_until is None else processed_until.isoformat(),
+        })
+        self.saved_version = state.version
+        return True
+
+
+# ============= ПОЛНОТЕКСТОВЫЙ ПОИСК =============
+# Инвертированный индекс по review_text в памяти процесса из неизменяемых сегментов
+# (термин -> документы и частоты); новые тексты дописываются новым сегментом,
+# соседние сегменты близкого размера сливаются
+# Сегмент сливается с предыдущим, пока тот не больше нового - сегментов остается O(log n)
+SEARCH_MERGE_RATIO = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+# terms - отсортированные номера терминов сегмента, postings термина terms[i] -
+# docs/tf[indptr[i]:indptr[i + 1]] (номера документов индекса по возрастанию и частоты)
+SearchSegment = namedtuple('SearchSegment', ['terms', 'indptr', 'docs', 'tf'])
+# Опубликованное состояние индекса: сегменты и массивы по номерам документов.
+# live - документ не заменен более новой версией отзыва
+SearchState = namedtuple('SearchState', ['segments', 'ids', 'lengths', 'live', 'docs', 'avg_length', 'version'])
+
+
+def _build_segment(terms, docs, tf):
+    # Тройки (термин, документ, частота), упорядоченные по термину, затем по документу
+    segment_terms, starts = np.unique(terms, return_index=True)
+    return SearchSegment(segment_terms, np.append(starts, len(terms)), docs, tf)
+
+
+def _merge_segments(segments, live):
+    # Сегменты покрывают идущие подряд диапазоны документов: устойчивая сортировка по термину
+    # сохраняет порядок документов. Слияние заодно выбрасывает постинги замененных документов
+    terms = np.concatenate([np.repeat(segment.terms, np.diff(segment.indptr)) for segment in segments])
+    docs = np.concatenate([segment.docs for segment in segments])
+    tf = np.concatenate([segment.tf for segment in segments])
+    keep = live[docs]
+    terms, docs, tf = terms[keep], docs[keep], tf[keep]
+    order = np.argsort(terms, kind='stable')
+    return _build_segment(terms[order], docs[order], tf[order])
+
+
+class SearchIndex:
+    def __init__(self):
+        # Основа слова -> номер термина; словоформа -> номер термина (стемминг один раз на словоформу)
+        self.vocabulary = {}
+        self.words = {}
+        self.state = SearchState((), np.empty(0, np.int64), np.empty(0, np.int32), np.empty(0, bool), 0, 0.0, 0)
+
+    def _term(self, word):
+        term = self.words.get(word)
+        if term is None:
+            stem = stem_ru(word)
+            term = self.vocabulary.setdefault(stem, len(self.vocabulary))
+            self.words[word] = term
+        return term
+
+    def add(self, rows, initial):
+        ids = rows['id'].to_numpy(dtype=np.int64)
+        tokens = [split_words(text) for text in rows['review_text'].tolist()]
+        state = self.state
+        base = len(state.ids)
+        
+        # Словоформы пакета - один factorize, стемминг только для новых словоформ,
+        # служебные слова отбрасываются по словарю пакета, а не по каждому вхождению
+        flat = np.array(list(chain.from_iterable(tokens)), dtype=object)
+        codes, words = pd.factorize(flat)
+        word_terms = np.fromiter(
+            (-1 if word in STOP_WORDS else self._term(word) for word in words), dtype=np.int64, count=len(words)
+        )
+        flat_terms = word_terms[codes]
+        docs = np.repeat(
+            np.arange(base, base + len(ids), dtype=np.int64),
+            np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+        )
+        indexed = flat_terms >= 0
+        flat_terms, docs = flat_terms[indexed], docs[indexed]
+        lengths = np.bincount(docs - base, minlength=len(ids)).astype(np.int32)
+        # Частота термина в документе - число одинаковых пар (термин, документ)
+        pairs, tf = np.unique(flat_terms * (base + len(ids)) + docs, return_counts=True)
+        segment = _build_segment(
+            (pairs // (base + len(ids))).astype(np.int32),
+            (pairs % (base + len(ids))).astype(np.int32),
+            np.minimum(tf, np.iinfo(np.uint16).max).astype(np.uint16),
+        )
+        
+        # Измененные отзывы: прежние документы с тем же id больше не находятся
+        live = state.live
+        if not initial:
+            live = live & ~np.isin(state.ids, ids)
+        live = np.append(live, np.ones(len(ids), dtype=bool))
+        segments = list(state.segments) + [segment]
+        while len(segments) > 1 and len(segments[-2].docs) <= len(segments[-1].docs) * SEARCH_MERGE_RATIO:
+            segments[-2:] = [_merge_segments(segments[-2:], live)]
+        
+        all_lengths = np.append(state.lengths, lengths)
+        live_docs = int(live.sum())
+        self.state = SearchState(
+            tuple(segments),
+            np.append(state.ids, ids),
+            all_lengths,
+            live,
+            live_docs,
+            float(all_lengths[live].sum()) / max(live_docs, 1),
+            state.version + 1,
+        )
+
+    def search(self, query):
+        # Документы со всеми словами запроса, ранжирование - BM25.
+        # Возвращает id отзывов и их оценки релевантности
+        state = self.state
+        empty = (np.empty(0, np.int64), np.empty(0, np.float64))
+        terms = {self.words.get(word, self.vocabulary.get(stem_ru(word))) for word in tokenize(query)}
+        if not terms or None in terms or state.docs == 0:
+            return empty
+        # Пересечение начинается с самого редкого термина: дальше проверяются только его кандидаты
+        postings = sorted((_postings(state, term) for term in terms), key=lambda posting: len(posting[0]))
+        matched = None
+        for term_docs, term_tf in postings:
+            if state.docs == len(state.ids):
+                frequency = len(term_docs)
+            else:
+                frequency = int(np.count_nonzero(state.live[term_docs]))
+            if matched is None:
+                alive = state.live[term_docs]
+                matched, tf, scores = term_docs[alive], term_tf[alive], 0.0
+            else:
+                # Постинги термина упорядочены по документу - бинарный поиск кандидатов
+                at = np.minimum(np.searchsorted(term_docs, matched), max(len(term_docs) - 1, 0))
+                found = term_docs[at] == matched if len(term_docs) else np.zeros(len(matched), dtype=bool)
+                matched, tf, scores = matched[found], term_tf[at[found]], scores[found]
+            if not len(matched):
+                return empty
+            scores = scores + _bm25(state, frequency, matched, tf)
+        return state.ids[matched], scores
+
+
+def _postings(state, term):
+    # Сегменты идут по возрастанию номеров документов, склейка постингов остается упорядоченной
+    docs, tf = [np.empty(0, np.int32)], [np.empty(0, np.uint16)]
+    for segment in state.segments:
+        i = np.searchsorted(segment.terms, term)
+        if i < len(segment.terms) and segment.terms[i] == term:
+            lo, hi = segment.indptr[i], segment.indptr[i + 1]
+            docs.append(segment.docs[lo:hi])
+            tf.append(segment.tf[lo:hi])
+    return np.concatenate(docs), np.concatenate(tf)
+
+
+def _bm25(state, frequency, docs, tf):
+    tf = tf.astype(np.float64)
+    idf = np.log(1 + (state.docs - frequency + 0.5) / (frequency + 0.5))
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * state.lengths[docs] / state.avg_length)
+    return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+
+@st.cache_resource
+def get_search_index():
+    return SearchIndex()
+
+
+def search_view(df, cube, index, query, cache=None):
+    # Совпадения поиска как позиции строк снимка (по возрастанию) и их релевантность;
+    # в ключе версии снимка и индекса - после обновления любого из них запись вытесняется
+    if cache is None:
+        cache = get_filter_cache()
+    words = tuple(tokenize(query))
+    
+    def compute():
+        ids, scores = index.search(query)
+        ids_column = df['id'].to_numpy()
+        positions = np.flatnonzero(np.isin(ids_column, ids))
+        return positions, scores[pd.Index(ids).get_indexer(ids_column[positions])]
+    
+    return cache.get(('search', cube.version, index.state.version, words), compute)
+
+
+# ============= ТОНАЛЬНОСТЬ =============
+# Тональность считается по тексту (text_analysis.score_texts, лексиконная модель из models/),
+# а не по корзинам рейтинга; оценки хранятся по id отзыва и пересчитываются только для новых и измененных
+SENTIMENT_PATH = _setting("SENTIMENT_PATH", ".cache/sentiment.arrow")
+# Отзывы без оценочных слов и еще не оцененные - по рейтингу: 1-2 негатив, 3 нейтрально, 4-5 позитив
+RATING_SENTIMENT = np.array([NEUTRAL, NEGATIVE, NEGATIVE, NEUTRAL, POSITIVE, POSITIVE], dtype=np.int8)
+# Метка по рейтингу хранится со сдвигом, чтобы считать отдельно долю оцененных по тексту
+RATING_LABEL_SHIFT = 3
+
+
+class SentimentStore(ReviewResults):
+    def __init__(self, path=SENTIMENT_PATH):
+        super().__init__(path, get_sentiment_model().version, {'label': (np.int8, 0), 'score': (np.float32, 0)})
+
+    def add(self, rows, initial):
+        rows = self.fresh(rows, initial)
+        if rows.empty:
+            return
+        scores, labels = map_text_batches(score_texts, rows['review_text'].tolist())
+        self.upsert(rows, {'label': labels, 'score': scores})
+
+
+@st.cache_resource
+def get_sentiment_store():
+    return SentimentStore()
+
+
+def sentiment_labels(df, cube, state, cache):
+    # Метка каждой строки снимка: по тексту, если он оценен и в нем есть оценочные слова,
+    # иначе по рейтингу со сдвигом RATING_LABEL_SHIFT
+    def compute():
+        labels = RATING_SENTIMENT[df['rating'].to_numpy()] + RATING_LABEL_SHIFT
+        at, found = locate_ids(state.ids, df['id'].to_numpy())
+        found = np.flatnonzero(found)
+        scored = state.columns['label'][at[found]]
+        opinion = scored != NO_OPINION
+        labels[found[opinion]] = scored[opinion]
+        return labels
+    
+    return cache.get(('sentiment', cube.version, state.version), compute)
+
+
+def sentiment_view(df, cube, store, window, cache=None):
+    # Счетчики меток текущего и предыдущего окна
+    if cache is None:
+        cache = get_filter_cache()
+    state = store.state
+    labels = sentiment_labels(df, cube, state, cache)
+    
+    def compute():
+        counts = np.bincount(labels[window.idx], minlength=2 * RATING_LABEL_SHIFT)
+        prev_counts = None
+        if window.prev_idx is not None:
+            prev_counts = np.bincount(labels[window.prev_idx], minlength=2 * RATING_LABEL_SHIFT)
+        return counts, prev_counts
+    
+    return cache.get(('sentiment_view', state.version) + window.key, compute)
+
+
+def with_sentiment(kpis, counts):
+    # Позитивные/нейтральные/негативные - по тексту; NPS остается по оценкам
+    if kpis is None or counts is None:
+        return kpis
+    combined = counts[:RATING_LABEL_SHIFT] + counts[RATING_LABEL_SHIFT:]
+    total = kpis['total']
+    return {
+        **kpis,
+        'positive': int(combined[POSITIVE]),
+        'neutral': int(combined[NEUTRAL]),
+        'negative': int(combined[NEGATIVE]),
+        'positive_pct': combined[POSITIVE] / total * 100 if total > 0 else 0,
+        'text_sentiment': int(counts[:RATING_LABEL_SHIFT].sum()),
+    }
+
+
+# ============= ПОВТОРЫ =============
+# Один текст в нескольких источниках и волны однотипных отзывов: подписи MinHash (text_analysis.minhash_texts)
+# хранятся по id отзыва и считаются только для новых и измененных текстов. Кандидаты в повторы - отзывы
+# с совпавшей полосой подписи (LSH, DEDUP_BANDS полос): сортировка ключей полос вместо сравнения всех пар.
+# Пара подтверждается, если подписи совпадают не меньше чем в DEDUP_SIMILARITY позиций
+DUPLICATES_PATH = _setting("DUPLICATES_PATH", ".cache/duplicates.arrow")
+DEDUP_BANDS = 8
+DEDUP_SIMILARITY = 0.6
+# Множитель ключа полосы: значения подписи в полосе сворачиваются в одно uint64
+_BAND_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+class DuplicateIndex(ReviewResults):
+    def __init__(self, path=DUPLICATES_PATH):
+        super().__init__(path, MINHASH_VERSION, {'signature': (np.uint32, MINHASH_SIZE)})
+
+    def add(self, rows, initial):
+        rows = self.fresh(rows, initial)
+        if rows.empty:
+            return
+        self.upsert(rows, {'signature': map_text_batches(minhash_texts, rows['review_text'].tolist())})
+
+
+@st.cache_resource
+def get_duplicate_index():
+    return DuplicateIndex()
+
+
+def _band_keys(band):
+    keys = np.zeros(len(band), dtype=np.uint64)
+    for column in band.T:
+        keys = (keys ^ column.astype(np.uint64)) * _BAND_MIX
+    return keys
+
+
+def _components(size, left, right):
+    # Связные компоненты по ребрам: корень компоненты - ее наименьшая вершина.
+    # Подвешивание корней к меньшему соседу и сжатие путей до неподвижной точки
+    parent = np.arange(size)
+    while True:
+        low = np.minimum(parent[left], parent[right])
+        if (parent[left] == low).all() and (parent[right] == low).all():
+            return parent
+        np.minimum.at(parent, parent[left], low)
+        np.minimum.at(parent, parent[right], low)
+        while True:
+            jumped = parent[parent]
+            if (jumped == parent).all():
+                break
+            parent = jumped
+
+
+def duplicate_clusters(state):
+    # Кластер каждого отзыва индекса: наименьший id кластера, -1 - повторов нет
+    clusters = np.full(len(state.ids), -1, dtype=np.int64)
+    signatures = state.columns['signature']
+    signed = np.flatnonzero(signatures[:, 0] != NO_SIGNATURE)
+    if len(signed) < 2:
+        return clusters
+    signatures = signatures[signed]
+    rows = MINHASH_SIZE // DEDUP_BANDS
+    left, right = [], []
+    for band in range(DEDUP_BANDS):
+        keys = _band_keys(signatures[:, band * rows:(band + 1) * rows])
+        order = np.argsort(keys)
+        keys = keys[order]
+        head = np.ones(len(keys), dtype=bool)
+        head[1:] = keys[1:] != keys[:-1]
+        # Отзыв сравнивается с первым отзывом своей корзины: пар столько же, сколько отзывов
+        first = np.maximum.accumulate(np.where(head, np.arange(len(keys)), 0))
+        left.append(order[first[~head]])
+        right.append(order[~head])
+    left, right = np.concatenate(left), np.concatenate(right)
+    similar = (signatures[left] == signatures[right]).mean(axis=1) >= DEDUP_SIMILARITY
+    left, right = left[similar], right[similar]
+    if not len(left):
+        return clusters
+    
+    roots = _components(len(signed), left, right)
+    sizes = np.bincount(roots, minlength=len(signed))
+    member = sizes[roots] > 1
+    # id отсортированы, поэтому наименьшая вершина компоненты - наименьший id
+    clusters[signed[member]] = state.ids[signed[roots[member]]]
+    return clusters
+
+
+def duplicate_labels(df, cube, state, cache):
+    # Кластер каждой строки снимка (-1 - не повтор) и признак кластера из нескольких источников
+    def compute():
+        labels = np.full(len(df), -1, dtype=np.int64)
+        clusters = cache.get(('duplicates', state.version), lambda: duplicate_clusters(state))
+        at, found = locate_ids(state.ids, df['id'].to_numpy())
+        labels[found] = clusters[at[found]]
+        
+        cross = np.zeros(len(df), dtype=bool)
+        members = np.flatnonzero(labels >= 0)
+        if len(members) and 'source' in df:
+            sources = df['source'].cat.codes.to_numpy()[members]
+            order = np.lexsort((sources, labels[members]))
+            cluster, source = labels[members][order], sources[order]
+            head = np.ones(len(order), dtype=bool)
+            head[1:] = cluster[1:] != cluster[:-1]
+            new_source = head.copy()
+            new_source[1:] |= source[1:] != source[:-1]
+            starts = np.flatnonzero(head)
+            spread = np.add.reduceat(new_source, starts) > 1
+            cross[members[order]] = np.repeat(spread, np.diff(np.append(starts, len(order))))
+        return labels, cross
+    
+    return cache.get(('duplicate_labels', cube.version, state.version), compute)
+
+
+def collapse_duplicates(idx, labels):
+    # Из каждого кластера в окне остается первый (самый ранний) отзыв
+    window = labels[idx]
+    members = np.flatnonzero(window >= 0)
+    _, first = np.unique(window[members], return_index=True)
+    keep = np.ones(len(idx), dtype=bool)
+    keep[members] = False
+    keep[members[first]] = True
+    return idx[keep]
+
+
+def duplicate_view(df, cube, index, window, cache=None):
+    # Окно без повторов и сводка повторов текущего окна
+    if cache is None:
+        cache = get_filter_cache()
+    state = index.state
+    labels, cross = duplicate_labels(df, cube, state, cache)
+    
+    def compute():
+        idx = collapse_duplicates(window.idx, labels)
+        prev_idx = None if window.prev_idx is None else collapse_duplicates(window.prev_idx, labels)
+        clusters = np.unique(labels[window.idx][labels[window.idx] >= 0])
+        cross_clusters = np.unique(labels[window.idx][cross[window.idx]])
+        summary = {
+            'duplicates': len(window.idx) - len(idx),
+            'clusters': len(clusters),
+            'cross_source': len(cross_clusters),
+        }
+        return Window(('once', state.version) + window.key, idx, prev_idx), summary
+    
+    return cache.get(('duplicate_view', state.version) + window.key, compute)
+
+
+# ============= АНОМАЛИИ =============
+# Всплески отзывов и негатива и провалы среднего рейтинга по каждому источнику, по дням и по часам.
+# Статистика ряда - экспоненциально взвешенные среднее и дисперсия, обновляемые по одной закрытой корзине:
+# состояние - O(числа рядов), при обновлении читается только хвост снимка после последней закрытой корзины.
+# Сезонность учитывается отдельной статистикой на каждый день недели (дневные ряды) и час суток (часовые)
+ANOMALIES_PATH = _setting("ANOMALIES_PATH", ".cache/anomalies.json")
+# Шаг ряда: длина корзины в секундах и число сезонных слотов
+ANOMALY_FREQS = {'D': (86400, 7), 'H': (3600, 24)}
+ANOMALY_TITLES = {'D': 'День', 'H': 'Час'}
+ANOMALY_METRICS = ['Отзывы', 'Негативные', 'Средний рейтинг']
+# Аномалия - рост числа отзывов и негатива, падение рейтинга
+ANOMALY_DIRECTIONS = np.array([1, 1, -1])[:, None]
+# Полупериод в обновлениях слота: 6 недель для дневных рядов, 6 суток для часовых
+ANOMALY_HALFLIFE = 6
+ANOMALY_ALPHA = 1 - 0.5 ** (1 / ANOMALY_HALFLIFE)
+ANOMALY_WARMUP = 4
+ANOMALY_Z = 3.5
+# На малых счетчиках z-оценка шумит: всплеск должен превышать ожидание хотя бы на столько отзывов,
+# а средний рейтинг корзины считается только по достаточному числу оценок
+ANOMALY_MIN_REVIEWS = 5
+ANOMALY_MIN_RATED = 10
+# Нижняя граница разброса среднего рейтинга корзины
+ANOMALY_RATING_SD = 0.3
+# Корзина закрывается с запасом на задержку доставки отзывов
+ANOMALY_DELAY = timedelta(minutes=10)
+ANOMALY_INTERVAL = timedelta(minutes=1)
+ANOMALY_KEEP = 500
+
+Anomaly = namedtuple('Anomaly', ['time', 'freq', 'source', 'metric', 'value', 'expected', 'z'])
+
+
+class AnomalyDetector:
+    def __init__(self, path=ANOMALIES_PATH):
+        self.path = path
+        self.sources = []
+        # Шаг -> следующая незакрытая корзина и статистика (показатель x слот x источник)
+        self.series = {}
+        self.anomalies = deque(maxlen=ANOMALY_KEEP)
+        self.version = 0
+        self.saved_version = 0
+        self.lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                saved = json.load(file)
+            self.sources = saved["sources"]
+            self.series = {
+                freq: {
+                    'next': state['next'],
+                    'count': np.array(state['count'], dtype=np.int64),
+                    'mean': np.array(state['mean'], dtype=np.float64),
+                    'var': np.array(state['var'], dtype=np.float64),
+                }
+                for freq, state in saved["series"].items()
+            }
+            self.anomalies.extend(
+                Anomaly(datetime.fromisoformat(item[0]), *item[1:]) for item in saved["anomalies"]
+            )
+        except (OSError, KeyError, ValueError, TypeError):
+            self.sources, self.series = [], {}
+            self.anomalies.clear()
+
+    def save(self):
+        # Вызывается задачей снимка: состояние - несколько массивов на шаг, файл маленький
+        with self.lock:
+            if not self.path or self.version == self.saved_version:
+                return False
+            saved = {
+                "sources": self.sources,
+                "series": {
+                    freq: {key: value if key == 'next' else value.tolist() for key, value in state.items()}
+                    for freq, state in self.series.items()
+                },
+                "anomalies": [[item.time.isoformat(), *item[1:]] for item in self.anomalies],
+            }
+            version = self.version
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(saved, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.saved_version = version
+        return True
+
+    def update(self, df, now):
+        if df.empty or 'review_date' not in df:
+            return False
+        with self.lock:
+            # Коды категорий снимка -> номера источников детектора (словарь источников маленький)
+            if 'source' in df:
+                categories = list(df['source'].cat.categories)
+                self.sources += [source for source in categories if source not in self.sources]
+                lookup = np.append(pd.Index(self.sources).get_indexer(categories), -1)
+                codes = df['source'].cat.codes.to_numpy()
+            else:
+                self.sources += [] if self.sources else ['—']
+                lookup, codes = np.zeros(1, dtype=np.int64), None
+            changed = False
+            for freq in ANOMALY_FREQS:
+                changed |= self._advance(freq, df, codes, lookup, now)
+            if changed:
+                self.version += 1
+            return changed
+
+    def _state(self, freq, first):
+        size, season = ANOMALY_FREQS[freq]
+        state = self.series.get(freq)
+        if state is None:
+            shape = (len(ANOMALY_METRICS), season, 0)
+            state = self.series[freq] = {
+                'next': first, 'count': np.zeros(shape, dtype=np.int64),
+                'mean': np.zeros(shape), 'var': np.zeros(shape),
+            }
+        # Новые источники начинают с пустой статистики
+        missing = len(self.sources) - state['count'].shape[2]
+        if missing > 0:
+            for key in ('count', 'mean', 'var'):
+                state[key] = np.pad(state[key], ((0, 0), (0, 0), (0, missing)))
+        return state
+
+    def _advance(self, freq, df, codes, lookup, now):
+        size, season = ANOMALY_FREQS[freq]
+        dates = df['review_date'].to_numpy()
+        cutoff = int(np.datetime64(now - ANOMALY_DELAY, 's').astype(np.int64)) // size
+        state = self._state(freq, int(dates[0].astype('datetime64[s]').astype(np.int64)) // size)
+        first = state['next']
+        if cutoff <= first:
+            return False
+        
+        # Снимок упорядочен по дате: строки закрываемых корзин - один срез
+        start, end = np.searchsorted(dates, [np.datetime64(first * size, 's'), np.datetime64(cutoff * size, 's')])
+        buckets = cutoff - first
+        sources = len(self.sources)
+        cells = dates[start:end].astype('datetime64[s]').astype(np.int64) // size - first
+        ratings = df['rating'].to_numpy()[start:end]
+        if codes is not None:
+            # Отзывы без источника в ряды не попадают
+            source = lookup[codes[start:end]]
+            known = source >= 0
+            cells, ratings = cells[known] * sources + source[known], ratings[known]
+        
+        def per_cell(weights=None):
+            return np.bincount(cells, weights=weights, minlength=buckets * sources).reshape(buckets, sources)
+        
+        reviews = per_cell()
+        rated = per_cell(ratings > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average = np.where(rated >= ANOMALY_MIN_RATED, per_cell(ratings.astype(np.float64)) / rated, np.nan)
+        values = np.stack([reviews, per_cell((ratings >= 1) & (ratings <= 2)), average], axis=1)
+        
+        for step in range(buckets):
+            slot = (first + step) % season
+            count, mean, var = state['count'][:, slot], state['mean'][:, slot], state['var'][:, slot]
+            value = values[step]
+            # Разброс счетчиков не ниже пуассоновского, рейтинга - не ниже ANOMALY_RATING_SD
+            spread = np.sqrt(var)
+            spread[:2] = np.maximum(spread[:2], np.sqrt(np.maximum(mean[:2], 1)))
+            spread[2] = np.maximum(spread[2], ANOMALY_RATING_SD)
+            z = (value - mean) / spread
+            excess = value - mean
+            excess[2] = ANOMALY_MIN_REVIEWS
+            flagged = (count >= ANOMALY_WARMUP) & (ANOMALY_DIRECTIONS * z >= ANOMALY_Z) & (excess >= ANOMALY_MIN_REVIEWS)
+            if flagged.any():
+                moment = datetime(1970, 1, 1) + timedelta(seconds=(first + step) * size)
+                for metric, source in zip(*np.nonzero(flagged)):
+                    self.anomalies.append(Anomaly(
+                        moment, freq, self.sources[source], ANOMALY_METRICS[metric],
+                        float(value[metric, source]), float(mean[metric, source]), float(z[metric, source]),
+                    ))
+            
+            # Инкрементальные EWMA среднего и дисперсии; первое наблюдение слота - начальное среднее
+            valid = ~np.isnan(value)
+            diff = np.where(valid, value - mean, 0)
+            step_mean = np.where(count > 0, ANOMALY_ALPHA * diff, diff)
+            var[:] = np.where(valid & (count > 0), (1 - ANOMALY_ALPHA) * (var + diff * step_mean), var)
+            mean += step_mean
+            count += valid
+        state['next'] = cutoff
+        return True
+
+
+@st.cache_resource
+def get_anomaly_detector():
+    return AnomalyDetector()
+
+
+def anomaly_frame(detector, sources, period_start, period_end):
+    # Аномалии окна по выбранным источникам, новые сверху
+    with detector.lock:
+        anomalies = list(detector.anomalies)
+    frame = pd.DataFrame(anomalies, columns=Anomaly._fields)
+    if frame.empty:
+        return frame
+    frame['time'] = pd.to_datetime(frame['time'])
+    # Пустой выбор источников - все источники, как в filter_reviews
+    keep = np.ones(len(frame), dtype=bool)
+    if sources:
+        keep &= frame['source'].isin(list(sources)).to_numpy()
+    if period_start is not None:
+        keep &= frame['time'] >= period_start
+    if period_end is not None:
+        keep &= frame['time'] < period_end
+    return frame[keep].sort_values('time', ascending=False, kind='stable', ignore_index=True)
+
+
+# ============= РЯДЫ ДЛЯ ГРАФИКОВ =============
+# Точек на линии не больше, чем помещается в колонку графика (~900 px при широкой раскладке,
+# ~5 px на точку); шаг агрегации выбирается по длине периода так, чтобы уложиться в предел
+CHART_POINTS = 180
+# Явно выбранный шаг соблюдается, но слишком длинный ряд все равно прореживается
+CHART_MAX_POINTS = 1000
+# Маркеры точек - только на коротких рядах
+CHART_MARKER_POINTS = 60
+CHART_BUCKETS = {'Авто': None, 'День': 'D', 'Неделя': 'W', 'Месяц': 'M', 'LTTB': 'lttb'}
+BUCKET_TITLES = {'D': 'по дням', 'W': 'по неделям', 'M': 'по месяцам'}
+BUCKET_HOVER = {'D': '%d.%m.%Y', 'W': 'неделя с %d.%m.%Y', 'M': '%m.%Y'}
+
+
+def bucket_daily(daily, freq):
+    # Суммы по неделям (с понедельника) или месяцам; средний рейтинг - взвешенный по числу отзывов
+    if freq == 'D' or daily.empty:
+        return daily
+    periods = daily['Дата'].dt.to_period(freq)
+    reviews = daily['Количество'].groupby(periods).sum()
+    rating_sums = (daily['Средний рейтинг'] * daily['Количество']).groupby(periods).sum()
+    return daily_frame(reviews.index.start_time, reviews.to_numpy(), rating_sums.to_numpy())
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: индексы threshold точек, сохраняющих форму ряда (пики и провалы).
+    # Первая и последняя точки остаются, из каждой корзины между ними берется точка с наибольшей
+    # площадью треугольника с выбранной точкой предыдущей корзины и средним следующей
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.floor(np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def chart_series(daily, bucket):
+    # Ряд для графика динамики: шаг агрегации и, при необходимости, прореживание LTTB
+    freq = CHART_BUCKETS[bucket]
+    limit = CHART_MAX_POINTS
+    if freq is None:
+        days = (daily['Дата'].max() - daily['Дата'].min()).days + 1 if not daily.empty else 0
+        freq = 'D' if days <= CHART_POINTS else 'W' if days <= CHART_POINTS * 7 else 'M'
+        limit = CHART_POINTS
+    elif freq == 'lttb':
+        freq, limit = 'D', CHART_POINTS
+    series = bucket_daily(daily, freq)
+    thinned = len(series) > limit
+    if thinned:
+        x = series['Дата'].to_numpy().astype('datetime64[D]').astype(np.float64)
+        series = series.iloc[lttb(x, series['Количество'].to_numpy(np.float64), limit)]
+    return series, freq, thinned
+
+
+def chart_flags(anomalies, series, freq):
+    # Отметки аномалий на графике динамики: точка корзины графика, в которую попала аномалия
+    if anomalies.empty or series.empty:
+        return pd.DataFrame(columns=['Дата', 'Количество', 'Описание'])
+    hourly = anomalies['freq'] == 'H'
+    moments = np.where(hourly, anomalies['time'].dt.strftime('%d.%m %H:00'), anomalies['time'].dt.strftime('%d.%m'))
+    values = np.where(
+        anomalies['metric'] == ANOMALY_METRICS[2],
+        anomalies['value'].map('{:.2f}'.format) + ' при норме ' + anomalies['expected'].map('{:.2f}'.format),
+        anomalies['value'].map('{:.0f}'.format) + ' при норме ' + anomalies['expected'].map('{:.0f}'.format),
+    )
+    labels = pd.Series(moments + ' ' + anomalies['source'] + ': ' + anomalies['metric'] + ' ' + values)
+    buckets = anomalies['time'].dt.to_period(freq).dt.start_time
+    flags = labels.groupby(buckets.to_numpy()).agg('<br>'.join).rename('Описание')
+    return series[['Дата', 'Количество']].merge(flags, left_on='Дата', right_index=True)
+
+
+# ============= ГРАФИКИ =============
+# Оформление собирается один раз из COLORS и общее для всех графиков
+CHART_LAYOUT = dict(
+    plot_bgcolor='white',
+    paper_bgcolor='white',
+    font=dict(family="Inter", size=11, color=COLORS['text_secondary']),
+    margin=dict(l=0, r=0, t=30, b=0),
+)
+GRID_AXIS = dict(showgrid=True, gridwidth=1, gridcolor=COLORS['border'], linecolor=COLORS['border'])
+LINE_AXIS = dict(linecolor=COLORS['border'])
+RATING_COLORS = [COLORS['danger'], COLORS['warning'], COLORS['secondary'], COLORS['info'], COLORS['success']]
+# Построение фигуры с проверкой свойств - десятки мс на график, поэтому готовые фигуры общие
+# для всех сессий процесса; ключ - хеш входных агрегатов, а не фильтр
+FIGURE_CACHE_BYTES = 32 * 1024 ** 2
+
+
+def dynamics_figure(series, freq, title, flags):
+    fig = make_subplots(
+        rows=2, cols=1,
+        row_heights=[0.7, 0.3],
+        shared_xaxes=True,
+        vertical_spacing=0.03,
+        subplot_titles=(f'Количество отзывов {title}', 'Средний рейтинг')
+    )
+    
+    # График количества
+    fig.add_trace(
+        go.Scatter(
+            x=series['Дата'],
+            y=series['Количество'],
+            mode='lines+markers' if len(series) <= CHART_MARKER_POINTS else 'lines',
+            name='Отзывы',
+            line=dict(color=COLORS['primary'], width=2),
+            marker=dict(size=6),
+            fill='tozeroy',
+            fillcolor=f"rgba(30, 64, 175, 0.1)"
+        ),
+        row=1, col=1
+    )
+    
+    if not flags.empty:
+        fig.add_trace(
+            go.Scatter(
+                x=flags['Дата'],
+                y=flags['Количество'],
+                mode='markers',
+                name='Аномалии',
+                marker=dict(color=COLORS['danger'], size=11, symbol='x'),
+                hovertext=flags['Описание'],
+                hovertemplate='%{hovertext}<extra></extra>'
+            ),
+            row=1, col=1
+        )
+    
+    # График рейтинга
+    fig.add_trace(
+        go.Bar(
+            x=series['Дата'],
+            y=series['Средний рейтинг'],
+            name='Рейтинг',
+            marker_color=COLORS['info'],
+            opacity=0.8
+        ),
+        row=2, col=1
+    )
+    
+    fig.update_layout(CHART_LAYOUT, height=400, showlegend=False, hovermode='x unified')
+    fig.update_xaxes(GRID_AXIS, hoverformat=BUCKET_HOVER[freq])
+    fig.update_yaxes(GRID_AXIS)
+    return fig
+
+
+def ratings_figure(rating_counts):
+    counts = [rating_counts[i] for i in range(1, 6)]
+    return go.Figure(
+        data=[
+            go.Bar(
+                x=[f"{i}★" for i in range(1, 6)],
+                y=counts,
+                marker_color=RATING_COLORS,
+                text=counts,
+                textposition='outside',
+                textfont=dict(size=12, weight=600)
+            )
+        ],
+        layout=go.Layout(
+            CHART_LAYOUT,
+            height=400,
+            showlegend=False,
+            xaxis=dict(LINE_AXIS, title=""),
+            yaxis=dict(GRID_AXIS, title="Количество"),
+        )
+    )
+
+
+def sources_figure(source_stats):
+    return go.Figure(
+        data=[
+            go.Pie(
+                labels=source_stats.index,
+                values=source_stats.values,
+                hole=0.4,
+                marker_colors=COLORS['chart_colors'][:len(source_stats)],
+                textinfo='label+percent',
+                textfont=dict(size=11)
+            )
+        ],
+        layout=go.Layout(
+            CHART_LAYOUT,
+            height=300,
+            showlegend=True,
+            legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.05),
+            margin=dict(l=0, r=80, t=30, b=0),
+        )
+    )
+
+
+def locations_figure(top_locations):
+    return go.Figure(
+        data=[
+            go.Bar(
+                y=top_locations.index,
+                x=top_locations.values,
+                orientation='h',
+                marker=dict(
+                    color=top_locations.values,
+                    colorscale=[[0, COLORS['info']], [1, COLORS['primary']]],
+                    showscale=False
+                ),
+                text=top_locations.values,
+                textposition='outside'
+            )
+        ],
+        layout=go.Layout(
+            CHART_LAYOUT,
+            height=300,
+            showlegend=False,
+            xaxis=dict(LINE_AXIS, title="Количество отзывов"),
+            yaxis=LINE_AXIS,
+        )
+    )
+
+
+def sentiment_figure(positive, neutral, negative):
+    sentiment_data = {
+        'Позитивные': positive,
+        'Нейтральные': neutral,
+        'Негативные': negative
+    }
+    return go.Figure(
+        data=[
+            go.Bar(
+                x=list(sentiment_data.keys()),
+                y=list(sentiment_data.values()),
+                marker_color=[COLORS['success'], COLORS['secondary'], COLORS['danger']],
+                text=list(sentiment_data.values()),
+                textposition='outside'
+            )
+        ],
+        layout=go.Layout(
+            CHART_LAYOUT,
+            height=300,
+            showlegend=False,
+            xaxis=LINE_AXIS,
+            yaxis=dict(GRID_AXIS, title="Количество"),
+        )
+    )
+
+
+def _figure_nbytes(fig):
+    # Размер фигуры - по ее JSON, считается один раз при построении
+    return len(plotly.io.to_json(fig, validate=False))
+
+
+@st.cache_resource
+def get_figure_cache():
+    return FilterCache(FIGURE_CACHE_BYTES, sizeof=_figure_nbytes)
+
+
+def chart_key(*values):
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            digest.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(value.tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+
+def get_chart(build, *values):
+    # Фигура строится только для новых данных; повторный показ - сериализация готового объекта
+    key = (build.__name__, chart_key(*values))
+    return get_figure_cache().get(key, lambda: build(*values))
+
+
+# ============= ФОНОВЫЙ ПЛАНИРОВЩИК =============
+# Представление по умолчанию (пресет "Последние 7 дней", все источники и оценки) -
+# считается заранее, первая сессия после обновления данных получает его из кэша
+DEFAULT_PERIOD = timedelta(days=7)
+DEFAULT_RATING_RANGE = (1, 5)
+# Границы скользящих периодов сдвигаются раз в минуту (см. ПРИМЕНЕНИЕ ФИЛЬТРОВ)
+PRECOMPUTE_INTERVAL = timedelta(minutes=1)
+
+
+# Периодическая задача и статистика ее запусков
+class Job:
+    def __init__(self, name, func, interval, align=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        # align - запуск в начале каждого интервала по часам, а не через интервал после предыдущего
+        self.align = align
+        self.wakeup = asyncio.Event()
+        self.runs = 0
+        self.failures = 0
+        self.running = False
+        self.last_started = None
+        self.last_duration = None
+        self.last_ok = None
+        self.last_error = None
+        self.last_failure = None
+
+    def delay(self):
+        seconds = self.interval.total_seconds()
+        if self.align:
+            seconds -= time.time() % seconds
+        return seconds
+
+
+# Один цикл asyncio в отдельном потоке на процесс: задачи ждут своих интервалов в цикле,
+# а сами выполняются в пуле потоков (клиент базы и pandas - блокирующие).
+# Корутины (подписки на поток изменений) выполняются прямо в цикле
+class Scheduler:
+    def __init__(self):
+        self.jobs = {}
+        self.tasks = []
+        self.loop = asyncio.new_event_loop()
+
+    def add(self, name, func, interval, align=False):
+        self.jobs[name] = Job(name, func, interval, align)
+
+    def start(self):
+        threading.Thread(target=self.loop.run_forever, name="scheduler", daemon=True).start()
+        for job in self.jobs.values():
+            self.loop.call_soon_threadsafe(self._spawn, job)
+
+    def _spawn(self, job):
+        # Цикл держит задачи только по слабым ссылкам - без своей ссылки ждущую задачу соберет gc
+        self.tasks.append(self.loop.create_task(self._loop_job(job)))
+
+    def trigger(self, name):
+        # Внеочередной запуск задачи; вызывающий поток его не ждет
+        job = self.jobs.get(name)
+        if job is not None:
+            self.loop.call_soon_threadsafe(job.wakeup.set)
+
+    async def _loop_job(self, job):
+        while True:
+            await self._run_job(job)
+            try:
+                await asyncio.wait_for(job.wakeup.wait(), job.delay())
+            except asyncio.TimeoutError:
+                pass
+            job.wakeup.clear()
+
+    async def _run_job(self, job):
+        job.last_started = datetime.now()
+        job.running = True
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                await job.func()
+            else:
+                await asyncio.to_thread(job.func)
+            job.last_ok = True
+        except Exception as error:
+            job.last_ok = False
+            # Ошибка не останавливает задачу: следующая попытка - по расписанию
+            job.failures += 1
+            job.last_error = f"{type(error).__name__}: {error}"
+            job.last_failure = datetime.now()
+        job.running = False
+        job.runs += 1
+        job.last_duration = time.perf_counter() - started
+
+    def stats(self):
+        return [
+            {
+                'name': job.name,
+                'runs': job.runs,
+                'failures': job.failures,
+                'running': job.running,
+                'last_started': job.last_started,
+                'last_duration': job.last_duration,
+                'last_ok': job.last_ok,
+                'last_error': job.last_error,
+                'last_failure': job.last_failure,
+            }
+            for job in self.jobs.values()
+        ]
+
+
+# ============= ПОТОК ИЗМЕНЕНИЙ =============
+# Новые и измененные отзывы приходят событиями сразу после записи, а не к очередному опросу:
+# "realtime" - Supabase Realtime (postgres_changes), "notify" - Postgres LISTEN/NOTIFY
+# (триггер в supabase/migrations, строка подключения DATABASE_URL), "local" - очередь в процессе.
+# Пусто - только опрос раз в REFRESH_INTERVAL
+CHANGE_FEED = _setting("CHANGE_FEED", "")
+FEED_CHANNEL = "reviews_changes"
+# С подпиской опрос остается страховкой от событий, пропущенных при переподключении
+FEED_POLL_INTERVAL = timedelta(minutes=10)
+# Пауза перед переподключением после обрыва подписки
+FEED_RETRY_INTERVAL = timedelta(seconds=10)
+FEED_TIMEOUT = timedelta(seconds=30)
+
+
+# Источник событий: run(emit, subscribed) - корутина в цикле планировщика. emit(rows) получает
+# список строк таблицы, subscribed() вызывается, когда подписка подтверждена.
+# Завершение run (с ошибкой или без) означает обрыв подписки
+class ChangeFeed(ABC):
+    @abstractmethod
+    async def run(self, emit, subscribed):
+        pass
+
+
+# Заглушка без внешних зависимостей: события публикуются из того же процесса
+class LocalFeed(ChangeFeed):
+    def __init__(self):
+        self.emit = None
+
+    def publish(self, rows):
+        if self.emit is not None:
+            self.emit(rows)
+
+    async def run(self, emit, subscribed):
+        self.emit = emit
+        subscribed()
+        await asyncio.Event().wait()
+
+
+class RealtimeFeed(ChangeFeed):
+    def __init__(self, url, key):
+        self.url = url
+        self.key = key
+
+    async def run(self, emit, subscribed):
+        from realtime import AsyncRealtimeClient, RealtimeSubscribeStates
+        # Клиент сам переподключается и заново подписывает канал; сюда возвращаемся, когда он сдался
+        client = AsyncRealtimeClient(f"{self.url}/realtime/v1", self.key)
+        status = asyncio.get_running_loop().create_future()
+        try:
+            channel = client.channel(FEED_CHANNEL)
+            for event in ("INSERT", "UPDATE"):
+                channel.on_postgres_changes(
+                    event, lambda payload: emit([payload["data"]["record"]]), table="reviews"
+                )
+            await channel.subscribe(lambda state, error: status.done() or status.set_result((state, error)))
+            state, error = await asyncio.wait_for(status, FEED_TIMEOUT.total_seconds())
+            if state != RealtimeSubscribeStates.SUBSCRIBED:
+                raise ConnectionError(f"Realtime: {state} {error or ''}".strip())
+            subscribed()
+            while client.is_connected:
+                await asyncio.sleep(1)
+            raise ConnectionError("Realtime: соединение закрыто")
+        finally:
+            await client.close()
+
+
+class NotifyFeed(ChangeFeed):
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    async def run(self, emit, subscribed):
+        import psycopg2
+        conn = await asyncio.to_thread(psycopg2.connect, self.dsn, keepalives=1, keepalives_idle=30)
+        conn.autocommit = True
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        try:
+            conn.cursor().execute(f"listen {FEED_CHANNEL}")
+            # Уведомления читаются по готовности сокета, без опроса и без отдельного потока
+            loop.add_reader(conn.fileno(), readable.set)
+            subscribed()
+            while True:
+                await readable.wait()
+                readable.clear()
+                conn.poll()
+                if conn.notifies:
+                    emit([json.loads(notify.payload) for notify in conn.notifies])
+                    conn.notifies.clear()
+        finally:
+            loop.remove_reader(conn.fileno())
+            conn.close()
+
+
+@st.cache_resource
+def get_change_feed():
+    if CHANGE_FEED == "realtime":
+        return RealtimeFeed(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    if CHANGE_FEED == "notify":
+        return NotifyFeed(_setting("DATABASE_URL", ""))
+    if CHANGE_FEED == "local":
+        return LocalFeed()
+    return None
+
+
+def precompute_default_view(state, cache, sentiment, duplicates):
+    if state.cube is None or state.df.empty:
+        return
+    now = datetime.now().replace(second=0, microsecond=0)
+    sources = snapshot_overview(state.df)['sources']
+    idx, _ = filtered_view(state.df, state.cube, now - DEFAULT_PERIOD, None, sources, DEFAULT_RATING_RANGE, cache)
+    window = review_window(state.df, state.cube, idx, now - DEFAULT_PERIOD, None, sources, DEFAULT_RATING_RANGE, cache)
+    sentiment_view(state.df, state.cube, sentiment, window, cache)
+    duplicate_view(state.df, state.cube, duplicates, window, cache)
+
+
+@st.cache_resource
+def get_scheduler():
+    scheduler = Scheduler()
+    sync = get_review_sync()
+    cache = get_filter_cache()
+    client = init_connection()
+    if client is None or DATA_BACKEND == "server":
+        sync.ready.set()
+        return scheduler
+    feed = get_change_feed()
+    texts = get_review_texts()
+    sentiment = get_sentiment_store()
+    duplicates = get_duplicate_index()
+    detector = get_anomaly_detector()
+
+    def refresh():
+        # Единственная задача, которая ходит в базу; сессии ее не запускают и не ждут
+        version = sync.state.version
+        try:
+            state = sync.refresh(client)
+            if state.version != version:
+                # Представление по умолчанию новой версии считается до того, как ее дождется первая сессия
+                precompute_default_view(state, cache, sentiment, duplicates)
+                scheduler.trigger("texts")
+                scheduler.trigger("anomalies")
+        finally:
+            sync.ready.set()
+        if sync.snapshot_version is None:
+            # Первый снимок пишется сразу после загрузки, дальше - по расписанию
+            scheduler.trigger("snapshot")
+
+    scheduler.add("refresh", refresh, FEED_POLL_INTERVAL if feed else REFRESH_INTERVAL)
+
+    def snapshot():
+        sync.save_snapshot()
+        sentiment.save()
+        duplicates.save()
+        detector.save()
+
+    def load_texts():
+        # Новые оценки тональности и подписи повторов меняют KPI представления по умолчанию - пересчет сразу
+        versions = sentiment.state.version, duplicates.state.version
+        texts.update(client)
+        if (sentiment.state.version, duplicates.state.version) != versions:
+            precompute_default_view(sync.state, cache, sentiment, duplicates)
+
+    scheduler.add("snapshot", snapshot, SNAPSHOT_INTERVAL)
+    # Тексты для поиска и тональности догружаются за снимком: после каждого обновления и события потока
+    scheduler.add("texts", load_texts, FEED_POLL_INTERVAL if feed else REFRESH_INTERVAL)
+    scheduler.add(
+        "precompute",
+        lambda: precompute_default_view(sync.state, cache, sentiment, duplicates),
+        PRECOMPUTE_INTERVAL,
+        align=True,
+    )
+    # Корзины рядов закрываются по времени: задача в начале каждой минуты досчитывает закрытые
+    scheduler.add("anomalies", lambda: detector.update(sync.state.df, datetime.now()), ANOMALY_INTERVAL, align=True)
+    if feed:
+        pending = []
+        pending_lock = threading.Lock()
+
+        def emit(rows):
+            with pending_lock:
+                pending.extend(rows)
+            scheduler.trigger("ingest")
+
+        def ingest():
+            # Пока идет применение, следующие события копятся и применяются одной пачкой
+            with pending_lock:
+                rows = pending[:]
+                del pending[:]
+            if rows:
+                precompute_default_view(sync.apply(rows), cache, sentiment, duplicates)
+                scheduler.trigger("texts")
+
+        async def listen():
+            # После (пере)подключения дельта по опросу закрывает окно, когда события не принимались
+            await feed.run(emit, lambda: scheduler.trigger("refresh"))
+
+        scheduler.add("ingest", ingest, FEED_POLL_INTERVAL)
+        scheduler.add("feed", listen, FEED_RETRY_INTERVAL)
+    scheduler.start()
+    return scheduler
+
+
+def refresh_now():
+    # Обновление данных отдельно от фильтров и ограничено по частоте для всего процесса
+    if not get_refresh_limit().allow():
+        return False
+    if DATA_BACKEND == "server":
+        # Сбрасываются только кэши серверных итогов, остальные кэши процесса не трогаются
+        load_overview.clear()
+        load_server_view.clear()
+        load_server_page.clear()
+        # Число строк таблицы этой сессии пересчитывается со следующей страницей
+        st.session_state.pop('table_rows_state', None)
+    else:
+        get_scheduler().trigger("refresh")
+    return True
+
+
+# Загрузка данных
+if DATA_BACKEND == "server":
+    df, cube = pd.DataFrame(), None
+    overview = load_overview()
+    data_stamp = ""
+    if overview['loaded_at'] is not None:
+        data_stamp = f"Итоги считает база · данные на {overview['loaded_at']:%d.%m.%Y %H:%M:%S}"
+else:
+    state = load_data()
+    df, cube = state.df, state.cube
+    overview = snapshot_overview(df)
+    data_stamp = ""
+    if state.version is not None:
+        data_stamp = (
+            f"Версия данных от {datetime.fromtimestamp(state.version / 1e9):%d.%m.%Y %H:%M:%S}"
+            f" · проверено {state.refreshed_at:%H:%M:%S}"
+        )
+        if CHANGE_FEED:
+            data_stamp += f" · поток изменений: {CHANGE_FEED}"
+
+if overview['total'] > 0:
+    # ============= ПАНЕЛЬ ФИЛЬТРОВ =============
+    with st.container():
+        st.markdown('<div class="section-card">', unsafe_allow_html=True)
+        st.markdown("## 🔍 Панель управления фильтрами")
+        
+        status_col, refresh_col = st.columns([4, 1])
+        with status_col:
+            st.caption(f"🕒 {data_stamp}")
+        with refresh_col:
+            if st.button("🔄 Обновить данные", use_container_width=True):
+                if refresh_now():
+                    st.toast("Обновление данных запущено")
+                else:
+                    st.toast(f"Данные обновлялись менее {MANUAL_REFRESH_INTERVAL.seconds} с назад")
+        
+        # Выбор типа периода
+        period_type = st.radio(
+            "Тип периода",
+            ["Предустановленный", "Произвольные даты", "Относительный"],
+            horizontal=True,
+            help="Выберите способ фильтрации по времени"
+        )
+        
+        st.markdown("---")
+        
+        # Фильтры в зависимости от типа периода
+        if period_type == "Предустановленный":
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                period_preset = st.selectbox(
+                    "Выберите период",
+                    ["Сегодня", "Вчера", "Последние 7 дней", "Последние 30 дней", "Последние 90 дней", "Весь период"],
+                    index=2
+                )
+            
+            with col2:
+                sources_filter = st.multiselect(
+                    "Источники",
+                    options=overview['sources'],
+                    default=overview['sources']
+                )
+            
+            with col3:
+                rating_filter = st.select_slider(
+                    "Диапазон рейтингов",
+                    options=[1, 2, 3, 4, 5],
+                    value=(1, 5)
+                )
+            
+            with col4:
+                st.markdown("<br>", unsafe_allow_html=True)
+                # Фильтры применяются при каждом запуске страницы: кнопка только перезапускает ее,
+                # кэши и загруженные данные не сбрасываются
+                st.button("Применить фильтры", type="primary", use_container_width=True)
+        
+        elif period_type == "Произвольные даты":
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                min_date, max_date = overview['first_date'], overview['last_date']
+                
+                date_from = st.date_input(
+                    "Дата начала",
+                    value=max_date - timedelta(days=30),
+                    min_value=min_date,
+                    max_value=max_date,
+                    format="DD.MM.YYYY"
+                )
+            
+            with col2:
+                date_to = st.date_input(
+                    "Дата окончания",
+                    value=max_date,
+                    min_value=min_date,
+                    max_value=max_date,
+                    format="DD.MM.YYYY"
+                )
+            
+            with col3:
+                sources_filter = st.multiselect(
+                    "Источники",
+                    options=overview['sources'],
+                    default=overview['sources']
+                )
+            
+            with col4:
+                rating_filter = st.select_slider(
+                    "Рейтинги",
+                    options=[1, 2, 3, 4, 5],
+                    value=(1, 5)
+                )
+        
+        else:  # Относительный период
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                relative_value = st.number_input("Количество", min_value=1, max_value=365, value=30)
+            
+            with col2:
+                relative_unit = st.selectbox("Единица", ["дней", "недель", "месяцев"])
+            
+            with col3:
+                sources_filter = st.multiselect(
+                    "Источники",
+                    options=overview['sources'],
+                    default=overview['sources']
+                )
+            
+            with col4:
+                rating_filter = st.select_slider(
+                    "Рейтинги",
+                    options=[1, 2, 3, 4, 5],
+                    value=(1, 5)
+                )
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Повторы (один текст в нескольких источниках, волны однотипных отзывов) - в KPI по одному разу
+    count_once = DATA_BACKEND != "server" and st.toggle(
+        "Считать повторы один раз",
+        value=False,
+        help="Из каждого кластера похожих текстов в KPI и тональности остается самый ранний отзыв; "
+             "уникальные клиенты и графики считаются по всем отзывам"
+    )
+    
+    # ============= ПРИМЕНЕНИЕ ФИЛЬТРОВ =============
+    # Период приводится к полуинтервалу [period_start, period_end).
+    # Скользящие периоды отсчитываются от начала текущей минуты: повторные запуски страницы
+    # в пределах минуты дают те же границы и попадают в кэши фильтров
+    now = datetime.now().replace(second=0, microsecond=0)
+    today = datetime.combine(now.date(), datetime.min.time())
+    period_start, period_end = None, None
+    
+    if period_type == "Предустановленный":
+        period_input = (period_type, period_preset)
+        if period_preset == "Сегодня":
+            period_start, period_end = today, today + timedelta(days=1)
+        elif period_preset == "Вчера":
+            period_start, period_end = today - timedelta(days=1), today
+        elif period_preset == "Последние 7 дней":
+            period_start = now - timedelta(days=7)
+        elif period_preset == "Последние 30 дней":
+            period_start = now - timedelta(days=30)
+        elif period_preset == "Последние 90 дней":
+            period_start = now - timedelta(days=90)
+    
+    elif period_type == "Произвольные даты":
+        period_input = (period_type, date_from, date_to)
+        period_start = datetime.combine(date_from, datetime.min.time())
+        period_end = datetime.combine(date_to, datetime.min.time()) + timedelta(days=1)
+    
+    else:  # Относительный
+        period_input = (period_type, relative_value, relative_unit)
+        days = relative_value
+        if relative_unit == "недель":
+            days = relative_value * 7
+        elif relative_unit == "месяцев":
+            days = relative_value * 30
+        period_start = now - timedelta(days=days)
+    
+    # Выбор источников для ключей кэшей и запросов: порядок выбора не важен; str - как в filter_key,
+    # в снимке среди источников бывает NaN (отзывы без источника), он не сравнивается со строками
+    sources_key = tuple(sorted(str(source) for source in sources_filter))
+    
+    if DATA_BACKEND == "server":
+        view = load_server_view(period_start, period_end, sources_key, tuple(rating_filter))
+        anomalies = pd.DataFrame(columns=Anomaly._fields)
+    else:
+        filtered_idx, view = filtered_view(df, cube, period_start, period_end, sources_filter, rating_filter)
+        window = review_window(df, cube, filtered_idx, period_start, period_end, sources_filter, rating_filter)
+        unique_window, duplicate_summary = duplicate_view(df, cube, get_duplicate_index(), window)
+        kpis, prev_kpis = view['kpis'], view['prev_kpis']
+        if count_once:
+            window = unique_window
+            kpis, prev_kpis = window_kpis(df, window.idx, kpis), window_kpis(df, window.prev_idx, prev_kpis)
+        sentiment_counts, prev_sentiment_counts = sentiment_view(df, cube, get_sentiment_store(), window)
+        anomalies = anomaly_frame(get_anomaly_detector(), sources_filter, period_start, period_end)
+        view = {
+            **view,
+            'kpis': with_sentiment(kpis, sentiment_counts),
+            'prev_kpis': with_sentiment(prev_kpis, prev_sentiment_counts),
+        }
+    
+    kpis, prev_kpis = view['kpis'], view['prev_kpis']
+    total_reviews = kpis['total']
+    
+    def kpi_delta(name, kind):
+        if prev_kpis is None or (kind != 'percent' and prev_kpis['total'] == 0):
+            return None
+        return format_delta(kpis[name], prev_kpis[name], kind)
+    
+    delta_help = "Изменение относительно предыдущего периода той же длины"
+    
+    # ============= КЛЮЧЕВЫЕ МЕТРИКИ =============
+    st.markdown('<div class="section-card">', unsafe_allow_html=True)
+    st.markdown("## 📊 Ключевые показатели эффективности")
+    
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    
+    avg_rating = kpis['avg_rating']
+    positive_pct = kpis['positive_pct']
+    response_rate = kpis['response_rate']
+    unique_authors = kpis['unique_authors']
+    nps = kpis['nps']
+    
+    with col1:
+        st.metric(
+            label="Всего отзывов",
+            value=f"{total_reviews:,}",
+            delta=kpi_delta('total', 'percent'),
+            help=delta_help
+        )
+    
+    with col2:
+        st.metric(
+            label="Средний рейтинг",
+            value=f"{avg_rating:.2f}",
+            delta=kpi_delta('avg_rating', 'rating'),
+            help=delta_help
+        )
+    
+    with col3:
+        st.metric(
+            label="Позитивные",
+            value=f"{positive_pct:.0f}%",
+            delta=kpi_delta('positive_pct', 'points'),
+            help=delta_help
+        )
+    
+    with col4:
+        st.metric(
+            label="Ответы банка",
+            value=f"{response_rate:.0f}%",
+            delta=kpi_delta('response_rate', 'points'),
+            help=delta_help
+        )
+    
+    with col5:
+        st.metric(
+            label="Уникальных клиентов",
+            value=f"{unique_authors:,}",
+            delta=kpi_delta('unique_authors', 'percent'),
+            help=delta_help if DATA_BACKEND == "server" else
+                 f"Оценка HyperLogLog: погрешность ±{HLL_ERROR:.1%} (68%), "
+                 f"±{2 * HLL_ERROR:.1%} (95%). {delta_help}"
+        )
+    
+    with col6:
+        st.metric(
+            label="NPS Score",
+            value=f"{nps:.0f}",
+            delta=kpi_delta('nps', 'number'),
+            help=delta_help
+        )
+    
+    if DATA_BACKEND != "server" and duplicate_summary['clusters']:
+        st.caption(
+            f"🔁 Повторы в периоде: {duplicate_summary['duplicates']:,} отзывов сверх первого "
+            f"в {duplicate_summary['clusters']:,} кластерах, из них в нескольких источниках - "
+            f"{duplicate_summary['cross_source']:,}" + (" · в KPI учтены один раз" if count_once else "")
+        )
+    
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # ============= ГРАФИКИ - ПЕРВЫЙ РЯД =============
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        st.markdown('<div class="section-card">', unsafe_allow_html=True)
+        st.markdown("### 📈 Динамика отзывов и рейтингов")
+        
+        daily_stats = view['daily']
+        if not daily_stats.empty:
+            chart_bucket = st.radio(
+                "Шаг графика",
+                list(CHART_BUCKETS),
+                horizontal=True,
+                label_visibility="collapsed",
+                help="Авто - шаг по длине периода; LTTB - отбор характерных дней без усреднения"
+            )
+            # На длинных периодах график получает недели или месяцы вместо тысяч дневных точек
+            chart_stats, chart_freq, thinned = chart_series(daily_stats, chart_bucket)
+            bucket_title = BUCKET_TITLES[chart_freq]
+            if thinned:
+                bucket_title += f", {len(chart_stats)} из {len(bucket_daily(daily_stats, chart_freq))} точек"
+            
+            flags = chart_flags(anomalies, chart_stats, chart_freq)
+            fig = get_chart(dynamics_figure, chart_stats, chart_freq, bucket_title, flags)
+            
+            st.plotly_chart(fig, use_container_width=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    with col2:
+        st.markdown('<div class="section-card">', unsafe_allow_html=True)
+        st.markdown("### ⭐ Распределение оценок")
+        
+        if total_reviews > 0:
+            fig = get_chart(ratings_figure, kpis['rating_counts'])
+            
+            st.plotly_chart(fig, use_container_width=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
     # ============= ГРАФИКИ - ВТОРОЙ РЯД =============
     col1, col2, col3 = st.columns(3)
     
@@ -655,29 +3306,9 @@ if not df.empty:
         st.markdown('<div class="section-card">', unsafe_allow_html=True)
         st.markdown("### 📱 Источники отзывов")
         
-        if 'source' in filtered_df and not filtered_df.empty:
-            source_stats = filtered_df['source'].value_counts()
-            
-            fig = go.Figure(data=[
-                go.Pie(
-                    labels=source_stats.index,
-                    values=source_stats.values,
-                    hole=0.4,
-                    marker_colors=COLORS['chart_colors'][:len(source_stats)],
-                    textinfo='label+percent',
-                    textfont=dict(size=11)
-                )
-            ])
-            
-            fig.update_layout(
-                height=300,
-                showlegend=True,
-                legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.05),
-                plot_bgcolor='white',
-                paper_bgcolor='white',
-                font=dict(family="Inter", size=11, color=COLORS['text_secondary']),
-                margin=dict(l=0, r=80, t=30, b=0)
-            )
+        source_stats = view['sources']
+        if not source_stats.empty:
+            fig = get_chart(sources_figure, source_stats)
             
             st.plotly_chart(fig, use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
@@ -686,88 +3317,76 @@ if not df.empty:
         st.markdown('<div class="section-card">', unsafe_allow_html=True)
         st.markdown("### 🌍 География клиентов")
         
-        if 'author_location' in filtered_df:
-            location_df = filtered_df[filtered_df['author_location'].notna() & (filtered_df['author_location'] != '')]
-            if not location_df.empty:
-                top_locations = location_df['author_location'].value_counts().head(7)
-                
-                fig = go.Figure(data=[
-                    go.Bar(
-                        y=top_locations.index,
-                        x=top_locations.values,
-                        orientation='h',
-                        marker=dict(
-                            color=top_locations.values,
-                            colorscale=[[0, COLORS['info']], [1, COLORS['primary']]],
-                            showscale=False
-                        ),
-                        text=top_locations.values,
-                        textposition='outside'
-                    )
-                ])
-                
-                fig.update_layout(
-                    height=300,
-                    showlegend=False,
-                    plot_bgcolor='white',
-                    paper_bgcolor='white',
-                    font=dict(family="Inter", size=11, color=COLORS['text_secondary']),
-                    margin=dict(l=0, r=0, t=30, b=0),
-                    xaxis_title="Количество отзывов"
-                )
-                
-                fig.update_xaxes(linecolor=COLORS['border'])
-                fig.update_yaxes(linecolor=COLORS['border'])
-                
-                st.plotly_chart(fig, use_container_width=True)
+        top_locations = view['locations']
+        if not top_locations.empty:
+            fig = get_chart(locations_figure, top_locations)
+            
+            st.plotly_chart(fig, use_container_width=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col3:
         st.markdown('<div class="section-card">', unsafe_allow_html=True)
         st.markdown("### 💭 Анализ тональности")
         
-        if 'rating' in filtered_df and not filtered_df.empty:
-            sentiment_data = {
-                'Позитивные': len(filtered_df[filtered_df['rating'] >= 4]),
-                'Нейтральные': len(filtered_df[filtered_df['rating'] == 3]),
-                'Негативные': len(filtered_df[filtered_df['rating'] <= 2])
-            }
-            
-            fig = go.Figure(data=[
-                go.Bar(
-                    x=list(sentiment_data.keys()),
-                    y=list(sentiment_data.values()),
-                    marker_color=[COLORS['success'], COLORS['secondary'], COLORS['danger']],
-                    text=list(sentiment_data.values()),
-                    textposition='outside'
-                )
-            ])
-            
-            fig.update_layout(
-                height=300,
-                showlegend=False,
-                plot_bgcolor='white',
-                paper_bgcolor='white',
-                font=dict(family="Inter", size=11, color=COLORS['text_secondary']),
-                margin=dict(l=0, r=0, t=30, b=0),
-                yaxis_title="Количество"
-            )
-            
-            fig.update_xaxes(linecolor=COLORS['border'])
-            fig.update_yaxes(
-                showgrid=True,
-                gridwidth=1,
-                gridcolor=COLORS['border'],
-                linecolor=COLORS['border']
-            )
+        if total_reviews > 0:
+            fig = get_chart(sentiment_figure, kpis['positive'], kpis['neutral'], kpis['negative'])
             
             st.plotly_chart(fig, use_container_width=True)
+            if 'text_sentiment' in kpis:
+                st.caption(
+                    f"По тексту отзыва: {kpis['text_sentiment'] / total_reviews:.0%} отзывов; "
+                    "без оценочных слов и до обработки текста - по рейтингу"
+                )
+            else:
+                st.caption("По рейтингу: 4-5★ позитивные, 3★ нейтральные, 1-2★ негативные")
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # ============= АНОМАЛИИ =============
+    if DATA_BACKEND != "server":
+        st.markdown('<div class="section-card">', unsafe_allow_html=True)
+        st.markdown("### 🚨 Аномалии")
+        
+        if not anomalies.empty:
+            rating_metric = anomalies['metric'] == ANOMALY_METRICS[2]
+            anomalies_df = pd.DataFrame({
+                'Время': np.where(
+                    anomalies['freq'] == 'H',
+                    anomalies['time'].dt.strftime('%d.%m.%Y %H:00'),
+                    anomalies['time'].dt.strftime('%d.%m.%Y')
+                ),
+                'Шаг': anomalies['freq'].map(ANOMALY_TITLES),
+                'Источник': anomalies['source'],
+                'Показатель': anomalies['metric'],
+                'Значение': np.where(
+                    rating_metric, anomalies['value'].map('{:.2f}'.format), anomalies['value'].map('{:.0f}'.format)
+                ),
+                'Норма': np.where(
+                    rating_metric, anomalies['expected'].map('{:.2f}'.format), anomalies['expected'].map('{:.1f}'.format)
+                ),
+                'Отклонение': anomalies['z'].map('{:+.1f}σ'.format),
+            })
+            st.dataframe(anomalies_df, use_container_width=True, hide_index=True, height=min(400, 38 + 35 * len(anomalies_df)))
+        else:
+            st.info("Всплесков и провалов в выбранном периоде нет")
+        st.caption(
+            f"Ряды по каждому источнику по дням и часам; норма - EWMA отдельно по дням недели и часам суток, "
+            f"аномалия - отклонение от {ANOMALY_Z}σ: рост отзывов и негатива, падение рейтинга"
+        )
         st.markdown('</div>', unsafe_allow_html=True)
     
     # ============= ТАБЛИЦА ОТЗЫВОВ =============
     st.markdown('<div class="section-card">', unsafe_allow_html=True)
     st.markdown("## 📋 Детальный просмотр отзывов")
     
+    search_query = st.text_input(
+        "Поиск по тексту отзывов",
+        placeholder="Например: кэшбэк или блокировка карты",
+        help="Находит отзывы со всеми словами запроса в любой форме; упорядочиваются по релевантности"
+    ).strip()
+    search_index = get_search_index() if DATA_BACKEND != "server" else None
+    if search_query and search_index is not None and not get_review_texts().ready.is_set():
+        st.caption(f"⏳ Индекс поиска строится: проиндексировано {search_index.state.docs:,} отзывов")
+    
     # Фильтры для таблицы
     col1, col2, col3, col4 = st.columns(4)
     
@@ -776,33 +3395,85 @@ if not df.empty:
     with col2:
         show_with_response = st.checkbox("С ответом банка", value=False)
     with col3:
-        sort_option = st.selectbox("Сортировка", ["Дата ↓", "Рейтинг ↓", "Рейтинг ↑"])
+        sort_options = ["Дата ↓", "Рейтинг ↓", "Рейтинг ↑"]
+        if search_query and search_index is not None:
+            sort_options.insert(0, "Релевантность")
+        sort_option = st.selectbox("Сортировка", sort_options)
     with col4:
-        rows_count = st.selectbox("Показать строк", [10, 25, 50, 100], index=0)
-    
-    # Применение фильтров к таблице
-    table_df = filtered_df.copy()
-    
-    if show_negative and 'rating' in table_df:
-        table_df = table_df[table_df['rating'] <= 2]
-    
-    if show_with_response and 'bank_response' in table_df:
-        table_df = table_df[table_df['bank_response'].notna()]
-    
-    # Сортировка
-    if sort_option == "Дата ↓" and 'review_date' in table_df:
-        table_df = table_df.sort_values('review_date', ascending=False)
-    elif sort_option == "Рейтинг ↓" and 'rating' in table_df:
-        table_df = table_df.sort_values('rating', ascending=False)
-    elif sort_option == "Рейтинг ↑" and 'rating' in table_df:
-        table_df = table_df.sort_values('rating', ascending=True)
+        rows_count = st.selectbox("Строк на странице", TABLE_PAGE_SIZES, index=0)
+    
+    # Новые фильтры таблицы - снова с первой страницы. Период сравнивается по значениям виджетов:
+    # границы скользящих периодов сдвигаются каждую минуту, а листание сбрасываться не должно
+    table_state = (
+        period_input, sources_key, tuple(rating_filter),
+        show_negative, show_with_response, search_query, sort_option, rows_count
+    )
+    if st.session_state.get('table_state') != table_state:
+        st.session_state['table_state'] = table_state
+        st.session_state['table_page'] = 1
+    page = st.session_state.get('table_page', 1)
+    
+    # Применение фильтров к таблице: загружается и форматируется только текущая страница
+    if DATA_BACKEND == "server":
+        server_filters = (
+            period_start, period_end, sources_key, tuple(rating_filter),
+            show_negative, show_with_response, search_query, sort_option
+        )
+        # Число строк считается один раз на набор фильтров таблицы: листание его не пересчитывает
+        recount = st.session_state.get('table_rows_state') != table_state
+        page_df, counted = load_server_page(*server_filters, (page - 1) * rows_count, rows_count, recount)
+        if page_df.empty and page > 1:
+            # Строк стало меньше, чем до выбранной страницы - пересчет и последняя страница
+            if not recount:
+                recount = True
+                _, counted = load_server_page(*server_filters, 0, 1, True)
+            page = max(-(-counted // rows_count), 1)
+            page_df, _ = load_server_page(*server_filters, (page - 1) * rows_count, rows_count)
+        if recount:
+            st.session_state['table_rows_state'] = table_state
+            st.session_state['table_rows'] = counted
+        table_rows = st.session_state['table_rows']
+    else:
+        table_idx = filtered_idx
+        
+        if show_negative:
+            table_idx = table_idx[take(df, table_idx, 'rating') <= 2]
+        
+        if show_with_response and 'has_response' in df:
+            table_idx = table_idx[take(df, table_idx, 'has_response')]
+        
+        table_scores = None
+        if search_query:
+            # Совпадения индекса пересекаются с уже отобранными позициями
+            hit_idx, hit_scores = search_view(df, cube, search_index, search_query)
+            found = np.isin(hit_idx, table_idx, assume_unique=True)
+            table_idx, table_scores = hit_idx[found], hit_scores[found]
+        
+        table_rows = len(table_idx)
+        page = min(page, max(-(-table_rows // rows_count), 1))
+        # Сортируются только позиции страницы, сам кадр не переупорядочивается
+        page_idx = page_positions(df, table_idx, sort_option, (page - 1) * rows_count, rows_count, table_scores)
+        page_df = df.iloc[page_idx]
+        if not page_df.empty:
+            duplicate_of, cross_source = duplicate_labels(df, cube, get_duplicate_index().state, get_filter_cache())
+            page_df = page_df.assign(duplicate=np.where(
+                cross_source[page_idx], 'в разных источниках', np.where(duplicate_of[page_idx] >= 0, 'есть', '—')
+            ))
+            texts = load_review_texts(tuple(page_df['id'].tolist()))
+            page_df = page_df.merge(texts[['id', 'review_text']], on='id', how='left')
     
     # Отображение таблицы
-    if not table_df.empty:
-        display_columns = ['review_date', 'author', 'rating', 'review_text', 'source', 'author_location', 'bank_response']
-        display_columns = [col for col in display_columns if col in table_df.columns]
+    if not page_df.empty:
+        display_columns = [
+            'review_date', 'author', 'rating', 'review_text', 'source', 'author_location', 'has_response', 'duplicate'
+        ]
+        display_columns = [col for col in display_columns if col in page_df.columns]
         
-        display_df = table_df[display_columns].head(rows_count)
+        display_df = page_df[display_columns]
+        # Категории - в обычные строки, иначе вместе со страницей сериализуется весь словарь авторов
+        display_df = display_df.astype({
+            col: display_df[col].cat.categories.dtype for col in CATEGORY_COLUMNS if col in display_df
+        })
         
         # Переименование колонок
         column_mapping = {
@@ -812,23 +3483,23 @@ if not df.empty:
             'review_text': 'Текст отзыва',
             'source': 'Источник',
             'author_location': 'Город',
-            'bank_response': 'Ответ банка'
+            'has_response': 'Ответ банка',
+            'duplicate': 'Повторы'
         }
         display_df = display_df.rename(columns=column_mapping)
         
-        # Форматирование
+        # Форматирование - только для строк страницы; обрезка текста остается построчной:
+        # на сотнях строк .str медленнее одного прохода apply
         if 'Текст отзыва' in display_df:
             display_df['Текст отзыва'] = display_df['Текст отзыва'].apply(
                 lambda x: x[:200] + '...' if isinstance(x, str) and len(x) > 200 else x
             )
         
         if 'Ответ банка' in display_df:
-            display_df['Ответ банка'] = display_df['Ответ банка'].apply(
-                lambda x: '✓ Есть' if pd.notna(x) and x != '' else '—'
-            )
+            display_df['Ответ банка'] = np.where(display_df['Ответ банка'].to_numpy(dtype=bool), '✓ Есть', '—')
         
         if 'Дата' in display_df:
-            display_df['Дата'] = pd.to_datetime(display_df['Дата']).dt.strftime('%d.%m.%Y')
+            display_df['Дата'] = display_df['Дата'].dt.strftime('%d.%m.%Y')
         
         st.dataframe(
             display_df,
@@ -836,6 +3507,18 @@ if not df.empty:
             hide_index=True,
             height=400
         )
+        
+        # Соседние страницы запрашиваются только при переходе
+        pages = -(-table_rows // rows_count)
+        st.session_state['table_page'] = page
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            st.number_input("Страница", min_value=1, max_value=pages, step=1, key='table_page')
+        with col2:
+            first_row = (page - 1) * rows_count + 1
+            st.caption(
+                f"Строки {first_row:,}–{first_row + len(page_df) - 1:,} из {table_rows:,} · страница {page} из {pages:,}"
+            )
     else:
         st.info("Нет данных для отображения с выбранными фильтрами")
     
@@ -849,16 +3532,58 @@ if not df.empty:
         st.markdown(f"**МТС Банк** © {datetime.now().year} • Система мониторинга v2.0")
     
     with col2:
-        st.markdown(f"📊 Обработано **{len(filtered_df):,}** отзывов из **{len(df):,}** общих")
+        st.markdown(f"📊 Обработано **{total_reviews:,}** отзывов из **{overview['total']:,}** общих")
+        if DATA_BACKEND != "server":
+            cache_stats = get_filter_cache().stats()
+            st.caption(
+                f"Кэш фильтров: {cache_stats['hits']:,} попаданий, {cache_stats['misses']:,} промахов, "
+                f"{cache_stats['entries']} записей, {cache_stats['bytes'] / 1024 ** 2:.1f} МБ"
+            )
     
     with col3:
-        if not filtered_df.empty:
-            csv = filtered_df.to_csv(index=False).encode('utf-8')
+        if total_reviews > 0:
+            export_format = st.selectbox("Формат выгрузки", list(EXPORT_FORMATS), label_visibility="collapsed")
+            extension, mime = EXPORT_FORMATS[export_format]
+            # Файл собирается только по клику; повторный клик с теми же фильтрами берет готовый
+            if DATA_BACKEND == "server":
+                export_key = ('server', period_start, period_end, sources_key, tuple(rating_filter))
+                export_chunks = lambda: server_export_chunks(period_start, period_end, sources_filter, rating_filter)
+                max_age = EXPORT_TTL
+            else:
+                export_key = ('snapshot',) + filter_key(cube.version, period_start, period_end, sources_filter, rating_filter)
+                export_chunks = lambda: snapshot_export_chunks(df, filtered_idx)
+                max_age = None
             st.download_button(
-                label="📥 Экспорт в CSV",
-                data=csv,
-                file_name=f'mts_reviews_{datetime.now().strftime("%Y%m%d_%H%M")}.csv',
-                mime='text/csv'
+                label=f"📥 Экспорт в {export_format}",
+                data=lambda: export_file(export_key, export_chunks, export_format, max_age),
+                file_name=f'mts_reviews_{datetime.now().strftime("%Y%m%d_%H%M")}.{extension}',
+                mime=mime
+            )
+    
+    if DATA_BACKEND != "server":
+        # Фоновые задачи процесса: последние запуски, длительность и ошибки
+        jobs = get_scheduler().stats()
+        failing = any(job['last_ok'] is False for job in jobs)
+        with st.expander("⚙️ Фоновые задачи" + (" · последний запуск с ошибкой" if failing else "")):
+            st.dataframe(
+                pd.DataFrame({
+                    'Задача': [job['name'] for job in jobs],
+                    'Статус': [
+                        '⏳' if job['running'] else '—' if job['last_ok'] is None else '✅' if job['last_ok'] else '⚠️'
+                        for job in jobs
+                    ],
+                    'Запусков': [job['runs'] for job in jobs],
+                    'Ошибок': [job['failures'] for job in jobs],
+                    'Последний запуск': [
+                        f"{job['last_started']:%H:%M:%S}" if job['last_started'] else '—' for job in jobs
+                    ],
+                    'Длительность, с': [job['last_duration'] for job in jobs],
+                    'Последняя ошибка': [
+                        f"{job['last_failure']:%H:%M:%S} {job['last_error']}" if job['last_error'] else '' for job in jobs
+                    ],
+                }),
+                use_container_width=True,
+                hide_index=True
             )
 
 else:
@@ -0,0 +1,124 @@
+-- Агрегаты дашборда на стороне базы: режим DATA_BACKEND = "server".
+-- Функции вызываются через PostgREST RPC и возвращают только сгруппированные итоги.
+-- Границы периода - полуинтервал [period_start, period_end) в UTC, null - без границы;
+-- пустой или null массив sources - все источники.
+
+create index if not exists reviews_review_date_idx on public.reviews (review_date);
+
+
+-- Источники и границы дат для панели фильтров
+create or replace function public.review_overview()
+returns jsonb
+language sql
+stable
+set timezone = 'UTC'
+as $$
+    select jsonb_build_object(
+        'total', (select count(*) from public.reviews),
+        'sources', (
+            select coalesce(jsonb_agg(source order by source), '[]'::jsonb)
+            from (select distinct source from public.reviews where source is not null) s
+        ),
+        'first_review', (select min(review_date)::timestamp from public.reviews),
+        'last_review', (select max(review_date)::timestamp from public.reviews)
+    )
+$$;
+
+
+-- KPI окна: распределение оценок, ответы банка, уникальные авторы
+create or replace function public.review_kpis(
+    period_start timestamp default null,
+    period_end timestamp default null,
+    sources text[] default null,
+    rating_min int default 1,
+    rating_max int default 5
+)
+returns jsonb
+language sql
+stable
+set timezone = 'UTC'
+as $$
+    with filtered as (
+        select rating::int as rating, author, coalesce(bank_response, '') <> '' as has_response
+        from public.reviews
+        where (period_start is null or review_date >= period_start)
+          and (period_end is null or review_date < period_end)
+          and (coalesce(cardinality(sources), 0) = 0 or source = any(sources))
+          and rating between rating_min and rating_max
+    )
+    select jsonb_build_object(
+        'ratings', (
+            select coalesce(jsonb_object_agg(rating, reviews), '{}'::jsonb)
+            from (select rating, count(*) as reviews from filtered group by rating) r
+        ),
+        'responses', (select count(*) from filtered where has_response),
+        'unique_authors', (select count(distinct author) from filtered)
+    )
+$$;
+
+
+-- Все секции дашборда за один вызов: KPI, ряд по дням, доли источников, топ городов
+create or replace function public.review_dashboard(
+    period_start timestamp default null,
+    period_end timestamp default null,
+    sources text[] default null,
+    rating_min int default 1,
+    rating_max int default 5,
+    location_limit int default 7
+)
+returns jsonb
+language sql
+stable
+set timezone = 'UTC'
+as $$
+    with filtered as (
+        select
+            review_date::date as day,
+            rating::int as rating,
+            source,
+            author,
+            author_location,
+            coalesce(bank_response, '') <> '' as has_response
+        from public.reviews
+        where (period_start is null or review_date >= period_start)
+          and (period_end is null or review_date < period_end)
+          and (coalesce(cardinality(sources), 0) = 0 or source = any(sources))
+          and rating between rating_min and rating_max
+    )
+    select jsonb_build_object(
+        'ratings', (
+            select coalesce(jsonb_object_agg(rating, reviews), '{}'::jsonb)
+            from (select rating, count(*) as reviews from filtered group by rating) r
+        ),
+        'responses', (select count(*) from filtered where has_response),
+        'unique_authors', (select count(distinct author) from filtered),
+        'daily', (
+            select coalesce(jsonb_agg(jsonb_build_array(day, reviews, rating_sum) order by day), '[]'::jsonb)
+            from (
+                select day, count(*) as reviews, sum(rating) as rating_sum
+                from filtered
+                group by day
+            ) d
+        ),
+        'sources', (
+            select coalesce(jsonb_agg(jsonb_build_array(source, reviews) order by reviews desc, source), '[]'::jsonb)
+            from (
+                select source, count(*) as reviews
+                from filtered
+                where source is not null
+                group by source
+            ) s
+        ),
+        'locations', (
+            select coalesce(jsonb_agg(jsonb_build_array(author_location, reviews) order by reviews desc, author_location), '[]'::jsonb)
+            from (
+                select author_location, count(*) as reviews
+                from filtered
+                where coalesce(author_location, '') <> ''
+                group by author_location
+                order by reviews desc, author_location
+                limit location_limit
+            ) l
+        )
+    )
+$$;
@@ -0,0 +1,39 @@
+-- Поток изменений таблицы reviews для приложения (CHANGE_FEED в secrets).
+-- "notify": триггер отправляет строку в канал reviews_changes на каждую вставку и изменение.
+-- Тексты в уведомление не входят (размер NOTIFY ограничен 8000 байт) - только признак ответа банка,
+-- остальное приложение догружает по id видимых строк.
+
+create or replace function public.notify_review_change()
+returns trigger
+language plpgsql
+as $$
+begin
+    perform pg_notify(
+        'reviews_changes',
+        (
+            to_jsonb(new) - 'review_text' - 'bank_response'
+            || jsonb_build_object('has_response', coalesce(new.bank_response, '') <> '')
+        )::text
+    );
+    return new;
+end;
+$$;
+
+drop trigger if exists reviews_notify_change on public.reviews;
+create trigger reviews_notify_change
+after insert or update on public.reviews
+for each row execute function public.notify_review_change();
+
+
+-- "realtime": таблица должна входить в публикацию Supabase Realtime
+do $$
+begin
+    if exists (select 1 from pg_publication where pubname = 'supabase_realtime')
+       and not exists (
+           select 1 from pg_publication_tables
+           where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'reviews'
+       ) then
+        alter publication supabase_realtime add table public.reviews;
+    end if;
+end;
+$$;
@@ -0,0 +1,7 @@
+-- Полнотекстовый поиск по отзывам в режиме DATA_BACKEND = "server".
+-- PostgREST строит фильтр review_text=wfts(russian).<запрос> как
+-- to_tsvector('russian', review_text) @@ websearch_to_tsquery('russian', <запрос>),
+-- индекс построен по тому же выражению, иначе планировщик его не использует.
+
+create index if not exists reviews_review_text_fts_idx
+    on public.reviews using gin (to_tsvector('russian', review_text));
@@ -0,0 +1,245 @@
+# Обработка текстов отзывов: слова, основы и тональность.
+# Отдельный модуль, а не streamlit_app.py: оценка тональности выполняется в процессах-обработчиках,
+# им нужен импортируемый модуль без побочных эффектов (скрипт приложения при импорте строит страницу)
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+from itertools import chain
+
+# ============= СЛОВА И ОСНОВЫ =============
+TOKEN_RE = re.compile(r"[0-9a-zа-яё]+")
+# Служебные слова не индексируются и не участвуют в запросе: они есть почти в каждом отзыве
+STOP_WORDS = frozenset(
+    "а без бы был была были было в вам вас весь во вот все всё вы где да для до его ее её если есть еще ещё же за "
+    "и из или им их к как ко когда кто ли либо мне мы на над не нет ни но ну о об однако он она они оно от по "
+    "под при про с со так также там то тоже только том ты у уже чем что чтобы эта эти это я".split()
+)
+
+# Стеммер Портера для русского языка (Snowball): окончания снимаются в области RV - после первой гласной
+_RU_RV = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+_RU_REGION = re.compile(r"[аеиоуыэюя][^аеиоуыэюя]")
+_RU_PERFECTIVE_GERUND = re.compile(r"((?<=[ая])(в|вши|вшись)|ив|ивши|ившись|ыв|ывши|ывшись)$")
+_RU_REFLEXIVE = re.compile(r"(ся|сь)$")
+_RU_ADJECTIVE = re.compile(
+    r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$"
+)
+_RU_PARTICIPLE = re.compile(r"((?<=[ая])(ем|нн|вш|ющ|щ)|ивш|ывш|ующ)$")
+_RU_VERB = re.compile(
+    r"((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)|"
+    r"ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)$"
+)
+_RU_NOUN = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_RU_SUPERLATIVE = re.compile(r"(ейше|ейш)$")
+
+
+def _region_start(word, start):
+    # Начало области R1/R2: после первой согласной, следующей за гласной
+    match = _RU_REGION.search(word, start)
+    return match.end() if match else len(word)
+
+
+def stem_ru(word):
+    word = word.replace('ё', 'е')
+    match = _RU_RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+    r2 = _region_start(word, _region_start(word, 0))
+    
+    # Шаг 1: деепричастие, иначе возвратность и прилагательное/причастие, глагол или существительное
+    stripped = _RU_PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _RU_REFLEXIVE.sub('', rv, 1)
+        stripped = _RU_ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _RU_PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _RU_VERB.sub('', rv, 1)
+            rv = _RU_NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+    
+    # Шаги 2-4: "и" на конце, словообразующее "ость" в R2, превосходная степень, "нн" и "ь"
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    for suffix in ('ость', 'ост'):
+        if rv.endswith(suffix) and len(prefix) + len(rv) - len(suffix) >= r2:
+            rv = rv[:-len(suffix)]
+            break
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _RU_SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def split_words(text):
+    return TOKEN_RE.findall(text.lower()) if isinstance(text, str) else []
+
+
+def tokenize(text):
+    return [word for word in split_words(text) if word not in STOP_WORDS]
+
+
+# ============= ТОНАЛЬНОСТЬ =============
+# Лексиконная модель - локальный артефакт, без сетевых вызовов: вес оценочного слова (по основе),
+# отрицание меняет знак ближайшего оценочного слова через несколько слов после него ("не рекомендую",
+# "нет проблем", "не очень хорошо"); знак препинания отрицание обрывает.
+# Оценка отзыва - сумма весов, деленная на корень из числа оценочных слов
+SENTIMENT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "sentiment_ru.json")
+# Метки тональности; NO_OPINION - в тексте нет оценочных слов
+NEGATIVE, NEUTRAL, POSITIVE = 0, 1, 2
+NO_OPINION = -1
+LABEL_NAMES = {NEGATIVE: "negative", NEUTRAL: "neutral", POSITIVE: "positive", NO_OPINION: "no_opinion"}
+# Границы частей предложения: отрицание не переходит через них
+CLAUSE_RE = re.compile(r"[.,;:!?…()\n]+")
+
+_model = None
+
+
+class SentimentModel:
+    def __init__(self, path=SENTIMENT_MODEL_PATH):
+        with open(path, encoding="utf-8") as file:
+            artifact = json.load(file)
+        self.version = artifact["version"]
+        self.negations = frozenset(artifact["negations"])
+        # Сколько слов после отрицания просматривается в поисках оценочного ("не очень хорошо")
+        self.negation_scope = artifact["negation_scope"]
+        self.negative_threshold, self.positive_threshold = artifact["thresholds"]
+        # Веса заданы для словоформ, поиск идет по основам - так же, как в поисковом индексе
+        self.weights = {}
+        for word, weight in artifact["weights"].items():
+            self.weights[stem_ru(word)] = float(weight)
+        # Размеченные фразы артефакта: модель с расходящимися метками не загружается
+        self.checks = artifact.get("checks", {})
+
+    def weigh(self, word):
+        return self.weights.get(stem_ru(word), 0.0)
+
+
+def get_sentiment_model():
+    # Модель загружается один раз на процесс (и в каждом процессе-обработчике)
+    global _model
+    if _model is None:
+        model = SentimentModel()
+        check_model(model)
+        _model = model
+    return _model
+
+
+def check_model(model):
+    texts = list(model.checks)
+    _, labels = score_texts(texts, model)
+    wrong = [
+        f"{text!r}: {LABEL_NAMES[label]} вместо {model.checks[text]}"
+        for text, label in zip(texts, labels.tolist())
+        if LABEL_NAMES[label] != model.checks[text]
+    ]
+    if wrong:
+        raise ValueError(f"Модель тональности {model.version} не проходит проверку: " + "; ".join(wrong))
+
+
+def score_texts(texts, model=None):
+    # Пакет текстов целиком: словоформы пакета - один factorize, вес и признак отрицания
+    # считаются один раз на словоформу, суммы по отзывам - bincount по номеру отзыва
+    model = model or get_sentiment_model()
+    clauses = [CLAUSE_RE.split(text) if isinstance(text, str) else [] for text in texts]
+    scores = np.zeros(len(clauses), dtype=np.float32)
+    labels = np.full(len(clauses), NO_OPINION, dtype=np.int8)
+    if not clauses:
+        return scores, labels
+    tokens = [split_words(clause) for clause in chain.from_iterable(clauses)]
+    flat = np.array(list(chain.from_iterable(tokens)), dtype=object)
+    codes, words = pd.factorize(flat)
+    weights = np.fromiter(map(model.weigh, words), dtype=np.float64, count=len(words))[codes]
+    negation = np.fromiter((word in model.negations for word in words), dtype=bool, count=len(words))[codes]
+    # Номер части предложения и отзыва для каждого слова пакета
+    parts = np.repeat(np.arange(len(tokens)), np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens)))
+    part_docs = np.repeat(np.arange(len(clauses)), np.fromiter(map(len, clauses), dtype=np.int64, count=len(clauses)))
+    docs = part_docs[parts]
+    
+    # Отрицание действует на первое оценочное слово не дальше negation_scope слов в той же части предложения:
+    # промежуточные "очень", "слишком" веса не имеют и пропускаются
+    opinion_at = np.flatnonzero(weights)
+    negation_at = np.flatnonzero(negation)
+    following = np.searchsorted(opinion_at, negation_at, side='right')
+    found = following < len(opinion_at)
+    negation_at, target = negation_at[found], opinion_at[following[found]]
+    scoped = (target - negation_at <= model.negation_scope) & (parts[target] == parts[negation_at])
+    weights[target[scoped]] *= -1
+    
+    opinions = np.bincount(docs, weights=weights != 0, minlength=len(clauses))
+    totals = np.bincount(docs, weights=weights, minlength=len(clauses))
+    rated = opinions > 0
+    scores[rated] = totals[rated] / np.sqrt(opinions[rated])
+    labels[rated] = NEUTRAL
+    labels[rated & (scores >= model.positive_threshold)] = POSITIVE
+    labels[rated & (scores <= model.negative_threshold)] = NEGATIVE
+    return scores, labels
+
+
+
+# ============= ПОВТОРЫ =============
+# MinHash: подпись текста - минимумы MINHASH_SIZE хеш-функций по шинглам (тройкам соседних слов);
+# доля совпавших позиций двух подписей оценивает сходство Жаккара их множеств шинглов.
+# Хеши детерминированы (crc32 слов и фиксированные коэффициенты), поэтому подписи можно хранить
+MINHASH_SIZE = 32
+MINHASH_VERSION = "minhash-32x3-1"
+SHINGLE_WORDS = 3
+# У коротких текстов подписи нет: "Спасибо, все отлично" от разных клиентов - не повтор
+MIN_SHINGLES = 4
+NO_SIGNATURE = np.uint32(0xFFFFFFFF)
+
+# Хеш-функции (a * x + b) mod p с простым p < 2^31: произведения помещаются в uint64 без переполнения
+_PRIME = np.uint64((1 << 31) - 1)
+_SHINGLE_BASE = np.uint64(1_000_003)
+
+
+def _coefficient(name):
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little") % ((1 << 31) - 2) + 1
+
+
+_MINHASH_A = np.array([_coefficient(f"a{k}") for k in range(MINHASH_SIZE)], dtype=np.uint64)
+_MINHASH_B = np.array([_coefficient(f"b{k}") for k in range(MINHASH_SIZE)], dtype=np.uint64)
+
+
+def minhash_texts(texts):
+    # Подписи пакета текстов (строки матрицы MINHASH_SIZE x uint32): хеш слова считается один раз
+    # на словоформу пакета, минимум по шинглам отзыва - reduceat по границам отзывов
+    tokens = [split_words(text) for text in texts]
+    signatures = np.full((len(tokens), MINHASH_SIZE), NO_SIGNATURE, dtype=np.uint32)
+    lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+    shingle_counts = np.maximum(lengths - SHINGLE_WORDS + 1, 0)
+    signed = np.flatnonzero(shingle_counts >= MIN_SHINGLES)
+    if not len(signed):
+        return signatures
+    
+    flat = np.array(list(chain.from_iterable(tokens[doc] for doc in signed)), dtype=object)
+    codes, words = pd.factorize(flat)
+    word_hashes = np.fromiter(
+        (zlib.crc32(word.encode()) for word in words), dtype=np.uint64, count=len(words)
+    )[codes] % _PRIME
+    
+    # Шингл начинается в каждой позиции, кроме последних SHINGLE_WORDS - 1 слов отзыва
+    doc_lengths = lengths[signed]
+    doc_ends = np.repeat(np.cumsum(doc_lengths), doc_lengths)
+    starts = np.flatnonzero(np.arange(len(flat)) + SHINGLE_WORDS <= doc_ends)
+    shingles = word_hashes[starts]
+    for offset in range(1, SHINGLE_WORDS):
+        shingles = (shingles * _SHINGLE_BASE + word_hashes[starts + offset]) % _PRIME
+    
+    bounds = np.cumsum(shingle_counts[signed]) - shingle_counts[signed]
+    rows = np.empty((len(signed), MINHASH_SIZE), dtype=np.uint32)
+    for k in range(MINHASH_SIZE):
+        rows[:, k] = np.minimum.reduceat((shingles * _MINHASH_A[k] + _MINHASH_B[k]) % _PRIME, bounds)
+    signatures[signed] = rows
+    return signatures